@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Runs the benchmark scenarios in-process, against synthetic dit directories
+# of several sizes (see generate.py), and reports the median and 95th
+# percentile of their wall-clock time and their peak of allocated memory, as
+# measured by tracemalloc in a separate run.
+#
+# The results may also be written as JSON, along with what the machine is,
+# to be compared later with compare.py.
+#
+# Usage: bench.py [--sizes GxSxT,...] [--runs N] [--scenarios name,...]
+#                 [--output results.json]
+
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from statistics import median
+
+from generate import generate
+
+# ===========================================
+# Constants
+
+# groups x subgroups x tasks
+DEFAULT_SIZES = '5x4x5,10x5x20,20x10x25'
+DEFAULT_RUNS = 10
+
+RESULTS_VERSION = 1
+
+# ===========================================
+# Scenarios
+#
+# Each one is a function of the dit directory, run once to warm up (which
+# also fills the caches) and then measured.
+
+
+def _dit(*argv):
+    from dit.dit import interpret, reset_general_options
+
+    reset_general_options()
+    interpret(list(argv))
+
+
+def _complete(path, *words):
+    from dit.completion import interpret
+
+    line = ['dit', '-d', path] + list(words)
+    # the index of the word to complete, the last one, counts from "-d"
+    candidates = interpret([str(len(line) - 1)] + line).split('\n')
+    if not all(candidate.startswith(words[-1]) and candidate != words[-1]
+               for candidate in candidates):
+        raise RuntimeError("Not completing %s: %s" % (words[-1], candidates))
+
+
+SCENARIOS = [
+    ('status', lambda d: _dit('-d', d, 'status')),
+    ('list-all-verbose', lambda d: _dit('-d', d, 'list', '--all', '-v')),
+    ('export-org', lambda d: _dit('-d', d, 'export', '--all',
+                                  '--format', 'org')),
+    ('sum', lambda d: _dit('-d', d, 'list', '--all', '--sum')),
+    ('where', lambda d: _dit('-d', d, 'list', '--all',
+                             '--where', 'priority', 'urgent')),
+    ('rebuild-index', lambda d: _dit('-d', d, 'rebuild-index')),
+    ('completion', lambda d: _complete(d, 'w', 'g001/')),
+    ('workon-halt', lambda d: (_dit('-d', d, 'workon', 'CURRENT'),
+                               _dit('-d', d, 'halt'))),
+]
+
+# ===========================================
+# Measures
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, math.ceil(p * len(values)) - 1)]
+
+
+def measure(scenario, path, runs):
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        scenario(path)
+
+        times = []
+        for __ in range(runs):
+            sys.stdout.seek(0)
+            sys.stdout.truncate()
+            start = time.perf_counter()
+            scenario(path)
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        scenario(path)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        sys.stdout = stdout
+
+    return {
+        'runs': runs,
+        'times': times,
+        'median': median(times),
+        'p95': percentile(times, 0.95),
+        'min': min(times),
+        'max': max(times),
+        'peak_memory': peak,
+    }
+
+
+def parse_sizes(sizes):
+    return [tuple(int(n) for n in size.split('x'))
+            for size in sizes.split(',')]
+
+
+def run(sizes, runs, names, report=print):
+    results = []
+    for (groups, subgroups, tasks) in sizes:
+        with tempfile.TemporaryDirectory(prefix='dit-bench-') as tmp:
+            # the caches of dit go with the dataset
+            os.environ['XDG_CACHE_HOME'] = os.path.join(tmp, 'cache')
+            path = os.path.join(tmp, 'dit')
+            count = generate(path, groups, subgroups, tasks)
+            report("%d tasks (%dx%dx%d)" % (count, groups, subgroups, tasks))
+            report("  %-18s %10s %10s %10s"
+                   % ('scenario', 'median', 'p95', 'peak'))
+            for name, scenario in SCENARIOS:
+                if names and name not in names:
+                    continue
+                stats = measure(scenario, path, runs)
+                stats.update({
+                    'scenario': name,
+                    'tasks': count,
+                    'size': [groups, subgroups, tasks],
+                })
+                results.append(stats)
+                report("  %-18s %8.2fms %8.2fms %7dKiB"
+                       % (name, stats['median'] * 1000, stats['p95'] * 1000,
+                          stats['peak_memory'] // 1024))
+    return results
+
+
+def machine_info():
+    return {
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_implementation() + ' ' +
+        platform.python_version(),
+    }
+
+
+def save_results(fp, results, runs):
+    with open(fp, 'w') as f:
+        json.dump({
+            'version': RESULTS_VERSION,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'machine': machine_info(),
+            'runs': runs,
+            'results': results,
+        }, f, indent=2)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Runs the benchmark scenarios of dit.")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help="groups x subgroups x tasks, comma separated")
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS)
+    parser.add_argument('--scenarios', default='',
+                        help="names of the scenarios to run, comma separated")
+    parser.add_argument('--output', help="file to write the results to")
+    args = parser.parse_args(argv)
+
+    names = [name for name in args.scenarios.split(',') if name]
+    unknown = set(names) - set(name for name, __ in SCENARIOS)
+    if unknown:
+        parser.error("no such scenario: %s" % ', '.join(sorted(unknown)))
+
+    output = os.path.abspath(args.output) if args.output else None
+    # away from a DIT_TESTING file, which would fake the current time
+    os.chdir(tempfile.gettempdir())
+    results = run(parse_sizes(args.sizes), args.runs, names)
+    if output:
+        save_results(output, results, args.runs)
+        print("Results written to %s" % output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Compares two result files of bench.py, scenario by scenario and size by
+# size, and fails when the new results regressed.
+#
+# A median is a regression when it grew by more than all of: the relative
+# threshold, the noise of both runs (how far their 95th percentile is from
+# their median) and an absolute minimum, so that scenarios of a few
+# milliseconds do not fail on jitter. The peak of memory is held to the same
+# relative threshold, with its own absolute minimum.
+#
+# Usage: compare.py [--threshold RATIO] [--min-delta MS] [--min-memory KIB]
+#                   <base.json> <new.json>
+
+import argparse
+import json
+import sys
+
+# ===========================================
+# Constants
+
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_MIN_DELTA_MS = 0.5
+DEFAULT_MIN_MEMORY_KIB = 64
+
+# ===========================================
+# Comparison
+
+
+def load_results(fp):
+    with open(fp) as f:
+        data = json.load(f)
+    results = {(r['scenario'], r['tasks']): r for r in data['results']}
+    return data, results
+
+
+def noise(stats):
+    return stats['p95'] - stats['median']
+
+
+def compare_time(base, new, threshold, min_delta):
+    delta = new['median'] - base['median']
+    allowed = max(threshold * base['median'], noise(base) + noise(new),
+                  min_delta)
+    if delta > allowed:
+        return 'REGRESSION'
+    if -delta > allowed:
+        return 'faster'
+    return 'ok'
+
+
+def compare_memory(base, new, threshold, min_memory):
+    delta = new['peak_memory'] - base['peak_memory']
+    allowed = max(threshold * base['peak_memory'], min_memory)
+    if delta > allowed:
+        return 'REGRESSION'
+    if -delta > allowed:
+        return 'smaller'
+    return 'ok'
+
+
+def _change(base, new):
+    if not base:
+        return '-'
+    return '%+.1f%%' % ((new - base) * 100 / base)
+
+
+def compare(base, new, threshold, min_delta, min_memory, report=print):
+    def line(text):
+        report(text.rstrip())
+
+    regressions = 0
+    line("%-18s %6s %10s %10s %8s %-10s %8s %-10s"
+           % ('scenario', 'tasks', 'base', 'new', 'time', '',
+              'memory', ''))
+    keys = sorted(set(base) | set(new), key=lambda k: (k[1], k[0]))
+    for key in keys:
+        scenario, tasks = key
+        if key not in new:
+            line("%-18s %6d %8.2fms %10s %8s %-10s"
+                   % (scenario, tasks, base[key]['median'] * 1000, '-', '',
+                      'missing'))
+            continue
+        if key not in base:
+            line("%-18s %6d %10s %8.2fms %8s %-10s"
+                   % (scenario, tasks, '-', new[key]['median'] * 1000, '',
+                      'new'))
+            continue
+        b, n = base[key], new[key]
+        time_status = compare_time(b, n, threshold, min_delta)
+        memory_status = compare_memory(b, n, threshold, min_memory)
+        regressions += [time_status, memory_status].count('REGRESSION')
+        line("%-18s %6d %8.2fms %8.2fms %8s %-10s %8s %-10s"
+               % (scenario, tasks, b['median'] * 1000, n['median'] * 1000,
+                  _change(b['median'], n['median']), time_status,
+                  _change(b['peak_memory'], n['peak_memory']),
+                  memory_status))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Compares two result files of bench.py.")
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="relative growth allowed, e.g. 0.10 for 10%%")
+    parser.add_argument('--min-delta', type=float,
+                        default=DEFAULT_MIN_DELTA_MS,
+                        help="milliseconds a median may always grow by")
+    parser.add_argument('--min-memory', type=int,
+                        default=DEFAULT_MIN_MEMORY_KIB,
+                        help="KiB a peak of memory may always grow by")
+    args = parser.parse_args(argv)
+
+    base_data, base = load_results(args.base)
+    new_data, new = load_results(args.new)
+    if base_data.get('machine') != new_data.get('machine'):
+        print("Warning: the results come from different machines",
+              file=sys.stderr)
+
+    regressions = compare(base, new, args.threshold, args.min_delta / 1000,
+                          args.min_memory * 1024)
+    if regressions:
+        print("%d regression(s)" % regressions, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
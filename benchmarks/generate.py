@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Generates a synthetic dit directory, with GROUPS groups of SUBGROUPS
+# subgroups of TASKS tasks each. Every task gets up to LOGBOOK logbook
+# entries, PROPERTIES properties and NOTES notes, and a part of them is
+# concluded. The same seed always gives the same directory.
+#
+# Usage: generate.py [--groups N] [--subgroups N] [--tasks N] [--logbook N]
+#                    [--properties N] [--notes N] [--seed N] <directory>
+
+import argparse
+import json
+import os
+import random
+import sys
+
+from datetime import datetime, timedelta, timezone
+
+# ===========================================
+# Constants
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S %z'
+
+# the logbooks end at this date at the latest
+END = datetime(2024, 6, 28, 18, 0, tzinfo=timezone(timedelta(hours=-3)))
+
+PROPERTY_NAMES = ['priority', 'client', 'sprint', 'component', 'estimate',
+                  'reviewer', 'ticket', 'area']
+PRIORITIES = ['low', 'medium', 'high', 'urgent']
+
+WORDS = ['fix', 'review', 'update', 'the', 'parser', 'index', 'export',
+         'meeting', 'with', 'client', 'about', 'release', 'notes', 'tests',
+         'for', 'slow', 'listing', 'and', 'docs', 'cleanup']
+
+CONCLUDED_RATIO = 0.3
+
+# ===========================================
+# Tasks
+
+
+def _text(rnd, words):
+    return ' '.join(rnd.choice(WORDS) for __ in range(words)).capitalize()
+
+
+def _date(dt):
+    return dt.strftime(DATE_FORMAT)
+
+
+def _property(rnd, name, i):
+    if name == 'priority':
+        return rnd.choice(PRIORITIES)
+    if name == 'estimate':
+        return '%dh' % rnd.randint(1, 16)
+    return '%s-%d' % (name, rnd.randint(0, max(i, 10)))
+
+
+def make_task(rnd, i, logbook, properties, notes):
+    entries = []
+    end = END - timedelta(minutes=rnd.randint(0, 60 * 24 * 30))
+    for __ in range(rnd.randint(logbook // 2, logbook) if logbook else 0):
+        start = end - timedelta(minutes=rnd.randint(5, 240))
+        entries.append({'in': _date(start), 'out': _date(end)})
+        end = start - timedelta(minutes=rnd.randint(10, 60 * 24 * 3))
+    entries.reverse()
+
+    created_at = end - timedelta(days=rnd.randint(0, 30))
+    data = {
+        'title': _text(rnd, rnd.randint(3, 8)),
+        'logbook': entries,
+        'properties': {
+            name: _property(rnd, name, i)
+            for name in PROPERTY_NAMES[:rnd.randint(0, properties)]
+        },
+        'notes': [_text(rnd, rnd.randint(5, 20))
+                  for __ in range(rnd.randint(0, notes))],
+        'created_at': _date(created_at),
+    }
+    last = entries[-1]['out'] if entries else data['created_at']
+    data['updated_at'] = last
+    if entries and rnd.random() < CONCLUDED_RATIO:
+        data['concluded_at'] = last
+    return data
+
+# ===========================================
+# Directory
+
+
+def generate(path, groups=10, subgroups=5, tasks=20, logbook=20,
+             properties=4, notes=2, seed=0):
+    from dit.index import Index
+
+    rnd = random.Random(seed)
+    first = None
+    for g in range(groups):
+        for s in range(subgroups):
+            subgroup_path = os.path.join(path, 'g%03d' % g, 's%02d' % s)
+            os.makedirs(subgroup_path, exist_ok=True)
+            for t in range(tasks):
+                task_fp = os.path.join(subgroup_path, 't%04d' % t)
+                data = make_task(rnd, t, logbook, properties, notes)
+                with open(task_fp, 'w') as f:
+                    json.dump(data, f)
+                # as if last written when last updated
+                updated_at = datetime.strptime(data['updated_at'],
+                                               DATE_FORMAT).timestamp()
+                os.utime(task_fp, (updated_at, updated_at))
+                if first is None:
+                    first = ('g%03d' % g, 's%02d' % s, 't%04d' % t)
+
+    index = Index()
+    index.load(path)
+    index.rebuild()
+    index.save()
+
+    # a halted CURRENT task, so that the workflow commands can be run
+    with open(os.path.join(path, '.current'), 'w') as f:
+        json.dump({'group': first[0], 'subgroup': first[1],
+                   'task': first[2], 'halted': True}, f)
+    with open(os.path.join(path, '.previous'), 'w') as f:
+        json.dump([], f)
+    return groups * subgroups * tasks
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Generates a synthetic dit directory.")
+    parser.add_argument('directory')
+    parser.add_argument('--groups', type=int, default=10)
+    parser.add_argument('--subgroups', type=int, default=5)
+    parser.add_argument('--tasks', type=int, default=20)
+    parser.add_argument('--logbook', type=int, default=20)
+    parser.add_argument('--properties', type=int, default=4)
+    parser.add_argument('--notes', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    count = generate(args.directory, args.groups, args.subgroups, args.tasks,
+                     args.logbook, args.properties, args.notes, args.seed)
+    print("Generated %d tasks in %s" % (count, args.directory))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Fails when modules that are only needed by some commands get imported at
+# startup, or when the startup of dit, measured with `python -X importtime`,
+# regressed from a baseline taken with --save (as compare.py tells for the
+# scenarios of bench.py), or takes longer than a budget. As the import time
+# depends on the machine, there is no budget unless one is given, with
+# --budget or DIT_IMPORT_BUDGET_MS.
+#
+# Usage: import_time.py [--budget MS] [--baseline FILE [--threshold RATIO]]
+#                       [--save FILE]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from statistics import median
+
+RUNS = 15
+
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_MIN_DELTA_MS = 1.0
+
+STARTUP = "from dit.dit import interpret; interpret(['--help'])"
+
+LAZY_MODULES = [
+    'getpass',
+    'hashlib',
+    'importlib.util',
+    'pickle',
+    'subprocess',
+    'tempfile',
+    'tzlocal',
+]
+
+
+def import_time_ms():
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                         universal_newlines=True, check=True).stderr
+    total = 0
+    for line in out.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) != 3:
+            continue
+        name = fields[2]
+        # top level imports of dit, the nested ones are in their cumulative
+        if name.startswith(' dit') and not name.startswith('  '):
+            total += int(fields[1])
+    return total / 1000
+
+
+def eager_modules():
+    check = ("import sys; before = set(sys.modules); %s; "
+             "print(' '.join(set(sys.modules) - before))" % STARTUP)
+    out = subprocess.run([sys.executable, '-c', check],
+                         stdout=subprocess.PIPE, universal_newlines=True,
+                         check=True).stdout
+    # the usage message is printed first
+    imported = out.splitlines()[-1].split()
+    return sorted(m for m in imported
+                  if m in LAZY_MODULES or m.split('.')[0] == 'tzlocal')
+
+
+def load_baseline(fp):
+    with open(fp) as f:
+        return json.load(f)['startup_ms']
+
+
+def save_baseline(fp, startup):
+    with open(fp, 'w') as f:
+        json.dump({'startup_ms': startup}, f, indent=2)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Checks the startup import time of dit.")
+    budget = os.environ.get('DIT_IMPORT_BUDGET_MS')
+    parser.add_argument('--budget', type=float,
+                        default=float(budget) if budget else None,
+                        help="milliseconds the startup may take")
+    parser.add_argument('--baseline', help="file of a baseline to compare to")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="relative growth allowed, e.g. 0.10 for 10%%")
+    parser.add_argument('--save', help="file to write the startup time to")
+    args = parser.parse_args(argv)
+    failed = False
+
+    eager = eager_modules()
+    if eager:
+        print("Imported at startup: %s" % ', '.join(eager))
+        failed = True
+
+    # the first run also makes sure the bytecode is cached
+    import_time_ms()
+    times = [import_time_ms() for i in range(RUNS)]
+    startup = median(times)
+    print("Startup import time: %.1fms (median of %d)" % (startup, RUNS))
+    if args.budget is not None and startup > args.budget:
+        print("Startup exceeds the budget of %.1fms." % args.budget)
+        failed = True
+    if args.baseline:
+        base = load_baseline(args.baseline)
+        allowed = max(args.threshold * base, DEFAULT_MIN_DELTA_MS)
+        print("Baseline: %.1fms (%+.1f%%)"
+              % (base, (startup - base) * 100 / base if base else 0))
+        if startup - base > allowed:
+            print("Startup regressed from the baseline.")
+            failed = True
+    if args.save:
+        save_baseline(args.save, startup)
+        print("Startup time written to %s" % args.save)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -3,10 +3,7 @@
 import sys
 
 
-def completion():
-    argv = sys.argv
-    argv.pop(0)
-
+def run_completion(argv):
     from dit.completion import interpret
 
     comp_options = interpret(argv)
@@ -14,10 +11,33 @@ def completion():
     sys.stdout.write(comp_options)
 
 
+def run(argv):
+    from dit.dit import interpret
+
+    interpret(argv)
+
+
+def completion():
+    argv = sys.argv
+    argv.pop(0)
+
+    from dit.client import COMPLETION, forward
+
+    code = forward(COMPLETION, argv)
+    if code is None:
+        run_completion(argv)
+    else:
+        sys.exit(code)
+
+
 def main():
     argv = sys.argv
     argv.pop(0)
 
-    from dit.dit import interpret
+    from dit.client import COMMAND, forward
 
-    interpret(argv)
+    code = forward(COMMAND, argv)
+    if code is None:
+        run(argv)
+    else:
+        sys.exit(code)
@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import pickle
+import time
+import zlib
+
+from copy import deepcopy
+from datetime import datetime
+
+from . import messages as msg
+
+from .common import (
+    cache_home,
+    cache_path,
+    load_json_file,
+    save_json_file,
+    take_preloaded,
+)
+from .tracing import span
+from .utils import now, render_live, summarize
+
+# ===========================================
+# Constants
+
+FETCHES_FN = 'fetches'
+GENERATION_FN = 'generation'
+LOCAL_ZONE_FN = 'localzone'
+RESULTS_DIR = 'results'
+TASK_SHARDS_DIR = 'task-shards'
+
+LOCALTIME_FP = '/etc/localtime'
+
+FETCH_CACHE_VERSION = 1
+FETCH_TTL_ENV = 'DIT_FETCH_TTL'
+
+TASK_CACHE_VERSION = 3
+TASK_CACHE_MAX_BYTES = 32 * 1024 * 1024
+TASK_CACHE_SHARDS = 64
+
+# a file modified this recently may be modified again without its mtime
+# changing, so it is not cached yet
+TASK_CACHE_RACY_NS = 2 * 10**9
+
+# how old the last use of an entry has to be for it to be updated, so that
+# mere hits do not cause the cache to be rewritten
+TASK_CACHE_TOUCH_NS = 3600 * 10**9
+
+# ===========================================
+# Files
+
+
+def _make_dirs(path):
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+
+def _save_pickle(fp, obj):
+    tmp_fp = '%s.%d' % (fp, os.getpid())
+    _make_dirs(os.path.dirname(fp))
+    with open(tmp_fp, 'wb') as f:
+        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_fp, fp)
+
+# ===========================================
+# Generation
+#
+# The generation identifies the state of the dit directory. It is changed by
+# every command that modifies the dit directory. A random part makes sure
+# that a dit directory that is removed and created again never reaches an
+# old generation.
+
+
+def _generation_path(base_path):
+    return os.path.join(cache_path(base_path), GENERATION_FN)
+
+
+def load_generation(base_path):
+    try:
+        with open(_generation_path(base_path), 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def bump_generation(base_path):
+    generation = load_generation(base_path) or '0-'
+    counter = int(generation.split('-', 1)[0]) + 1
+    generation = '%d-%s' % (counter, os.urandom(4).hex())
+    try:
+        _make_dirs(cache_path(base_path))
+        with open(_generation_path(base_path), 'w') as f:
+            f.write(generation)
+    except OSError as err:
+        msg.warning("Could not update the cache generation: %s" % err)
+
+# ===========================================
+# Local Timezone
+#
+# Finding the local timezone means probing the environment, /etc/localtime
+# and zoneinfo files, so the zone found is kept (for each user) along with
+# what it was deduced from: the TZ variable and where /etc/localtime points.
+
+
+def _local_zone_source():
+    try:
+        localtime = os.readlink(LOCALTIME_FP)
+    except OSError:
+        # not a symlink or missing
+        try:
+            stat = os.stat(LOCALTIME_FP)
+            localtime = [stat.st_mtime_ns, stat.st_size]
+        except OSError:
+            localtime = None
+    return [os.environ.get('TZ'), localtime]
+
+
+def load_local_zone():
+    fp = os.path.join(cache_home(), LOCAL_ZONE_FN)
+    source = _local_zone_source()
+    try:
+        with open(fp, 'rb') as f:
+            cached_source, zone = pickle.load(f)
+        if cached_source == source:
+            return zone
+    except Exception:
+        # missing or unreadable, it is resolved again
+        pass
+
+    from tzlocal import get_localzone
+    zone = get_localzone()
+    try:
+        pickle.dumps(zone)
+    except Exception:
+        # some zones (e.g. read from a file without a name) cannot be kept
+        return zone
+    try:
+        _save_pickle(fp, (source, zone))
+    except OSError as err:
+        msg.warning("Could not save the local timezone: %s" % err)
+    return zone
+
+# ===========================================
+# Result Cache
+
+
+# Writes to the given file while keeping a copy of what was written. Live
+# durations are rendered in what goes to the file, but are kept marked in the
+# copy, so that they can be brought up to date when it is replayed.
+
+
+class Recorder:
+
+    def __init__(self, file):
+        self.file = file
+        self.chunks = []
+
+    def write(self, string):
+        self.chunks.append(string)
+        return self.file.write(render_live(string))
+
+    def flush(self):
+        self.file.flush()
+
+    def isatty(self):
+        return False
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+
+class ResultCache:
+
+    def __init__(self, base_path):
+        self.path = os.path.join(cache_path(base_path), RESULTS_DIR)
+        self.generation = load_generation(base_path)
+        if self.generation is None:
+            bump_generation(base_path)
+            self.generation = load_generation(base_path)
+
+    def _result_path(self, key):
+        digest = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+        return os.path.join(self.path, digest)
+
+    def replay(self, key, file):
+        if self.generation is None:
+            return False
+        try:
+            result = load_json_file(self._result_path(key))
+        except ValueError:
+            return False
+        current = now(inc=0)
+        if (not result or
+                result['key'] != key or
+                result['generation'] != self.generation or
+                result['date'] != str(current.date())):
+            return False
+        elapsed = current - datetime.fromtimestamp(result['rendered_at'],
+                                                   current.tzinfo)
+        file.write(render_live(result['output'], elapsed))
+        msg.verbose("Replayed cached result.")
+        return True
+
+    def save(self, key, output, rendered_at):
+        if self.generation is None:
+            return
+        result = {
+            'key': key,
+            'generation': self.generation,
+            'date': str(rendered_at.date()),
+            'rendered_at': rendered_at.timestamp(),
+            'output': output,
+        }
+        try:
+            _make_dirs(self.path)
+            save_json_file(self._result_path(key), result)
+        except OSError as err:
+            msg.warning("Could not save the result to the cache: %s" % err)
+
+# ===========================================
+# Task Cache
+#
+# Keeps the parsed task files, with dates already converted, keyed by their
+# path in the dit directory, along with their summaries. Both are pickled
+# separately, so that the summary can be loaded alone. An entry is only used
+# while the mtime and size of the task file are the ones it was stored with.
+#
+# The entries are spread over TASK_CACHE_SHARDS files by a hash of their key,
+# so that a command only loads the shards of the tasks it reads, and only
+# writes again those it changed. The least recently used entries of a shard
+# are evicted when it grows over its share of TASK_CACHE_MAX_BYTES.
+
+
+def load_task_cache(fp):
+    try:
+        with open(fp, 'rb') as f:
+            version, entries = pickle.load(f)
+    except Exception:
+        return None
+    return entries if version == TASK_CACHE_VERSION else None
+
+
+def _time_ns():
+    return int(time.time() * 10**9)
+
+
+class TaskCache:
+
+    def __init__(self, base_path, max_bytes=TASK_CACHE_MAX_BYTES):
+        self.base_path = base_path
+        self.path = os.path.join(cache_path(base_path), TASK_SHARDS_DIR)
+        self.max_shard_bytes = max_bytes // TASK_CACHE_SHARDS
+        self.shards = {}
+        self.dirty = set()
+
+    def _shard_path(self, shard):
+        return os.path.join(self.path, '%02x' % shard)
+
+    def shard_paths(self):
+        return [self._shard_path(shard) for shard in range(TASK_CACHE_SHARDS)]
+
+    def _entries(self, shard_fp):
+        entries = self.shards.get(shard_fp)
+        if entries is None:
+            entries = take_preloaded(shard_fp)
+            if entries is None:
+                # missing or unreadable, it is rebuilt
+                with span("task cache load", "storage",
+                          shard=os.path.basename(shard_fp)):
+                    entries = load_task_cache(shard_fp) or {}
+            self.shards[shard_fp] = entries
+        return entries
+
+    def get(self, task_fp, load, summary=False):
+        key = os.path.relpath(task_fp, self.base_path)
+        shard_fp = self._shard_path(zlib.crc32(key.encode()) %
+                                    TASK_CACHE_SHARDS)
+        entries = self._entries(shard_fp)
+        stat = os.stat(task_fp)
+        now_ns = _time_ns()
+
+        entry = entries.get(key)
+        if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            if now_ns - entry[2] > TASK_CACHE_TOUCH_NS:
+                entry[2] = now_ns
+                self.dirty.add(shard_fp)
+            return pickle.loads(entry[4] if summary else entry[3])
+
+        data = load(task_fp)
+        if now_ns - stat.st_mtime_ns > TASK_CACHE_RACY_NS:
+            entries[key] = [
+                stat.st_mtime_ns,
+                stat.st_size,
+                now_ns,
+                pickle.dumps(data, pickle.HIGHEST_PROTOCOL),
+                pickle.dumps(summarize(data), pickle.HIGHEST_PROTOCOL),
+            ]
+            self.dirty.add(shard_fp)
+        elif entry:
+            del entries[key]
+            self.dirty.add(shard_fp)
+        return summarize(data) if summary else data
+
+    def _evict(self, entries):
+        total = sum(len(entry[3]) + len(entry[4])
+                    for entry in entries.values())
+        if total <= self.max_shard_bytes:
+            return
+        by_use = sorted(entries.items(), key=lambda item: item[1][2])
+        for key, entry in by_use:
+            if total <= self.max_shard_bytes:
+                break
+            total -= len(entry[3]) + len(entry[4])
+            del entries[key]
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            with span("task cache save", "storage", shards=len(self.dirty)):
+                for shard_fp in sorted(self.dirty):
+                    entries = self.shards[shard_fp]
+                    self._evict(entries)
+                    _save_pickle(shard_fp, (TASK_CACHE_VERSION, entries))
+        except OSError as err:
+            msg.warning("Could not save the task cache: %s" % err)
+        self.dirty = set()
+
+# ===========================================
+# Fetch Cache
+#
+# Keeps what the data fetchers fetched for each task, keyed by its selector,
+# along with when it was fetched and the validator given with it, if any. It
+# is used instead of calling the fetcher for DIT_FETCH_TTL seconds (none by
+# default), and afterwards whenever the fetcher, given the validator, tells
+# that the data was not modified.
+
+
+def fetch_ttl():
+    try:
+        return max(0.0, float(os.environ.get(FETCH_TTL_ENV) or 0))
+    except ValueError:
+        return 0.0
+
+
+class FetchCache:
+
+    def __init__(self, base_path, ttl=None):
+        self.fp = os.path.join(cache_path(base_path), FETCHES_FN)
+        self.ttl = fetch_ttl() if ttl is None else ttl
+        try:
+            cached = load_json_file(self.fp)
+        except ValueError:
+            cached = None
+        if cached and cached.get('version') == FETCH_CACHE_VERSION:
+            self.entries = cached['entries']
+        else:
+            # missing or unreadable, the fetchers are called
+            self.entries = {}
+        self.dirty = False
+
+    def get(self, key):
+        # (data, validator, fresh), or `None` when nothing was fetched
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        fresh = time.time() - entry['fetched_at'] < self.ttl
+        return (deepcopy(entry['data']), entry['validator'], fresh)
+
+    def put(self, key, data, validator=None):
+        self.entries[key] = {
+            'fetched_at': time.time(),
+            'validator': validator,
+            'data': deepcopy(data),
+        }
+        self.dirty = True
+
+    def discard(self, key):
+        if self.entries.pop(key, None) is not None:
+            self.dirty = True
+
+    def touch(self, key):
+        # not modified since
+        self.entries[key]['fetched_at'] = time.time()
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            _make_dirs(os.path.dirname(self.fp))
+            save_json_file(self.fp, {
+                'version': FETCH_CACHE_VERSION,
+                'entries': self.entries,
+            })
+        except OSError as err:
+            msg.warning("Could not save the fetch cache: %s" % err)
+        self.dirty = False
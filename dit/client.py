@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from .common import cache_path, discover_base_path
+
+# ===========================================
+# Constants
+
+SERVER_FN = 'server.sock'
+
+COMMAND = 'command'
+COMPLETION = 'completion'
+STOP = 'stop'
+
+# ===========================================
+# Protocol
+#
+# A request is a 4 bytes length followed by NUL separated fields: the kind of
+# request, the working directory, the number of arguments, the arguments and
+# the environment. The stdin, stdout and stderr of the client are passed
+# along with it, so that they are used directly by the command. The server
+# answers with the pid of the process running the command and, once it is
+# done, with its exit code, one per line.
+
+
+def server_path(base_path):
+    return os.path.join(cache_path(base_path), SERVER_FN)
+
+
+def encode_request(kind, argv):
+    fields = [kind.encode(), os.getcwdb(), str(len(argv)).encode()]
+    fields += [os.fsencode(arg) for arg in argv]
+    fields += [name + b'=' + value for name, value in os.environb.items()]
+    payload = b'\0'.join(fields)
+    return len(payload).to_bytes(4, 'big') + payload
+
+
+def decode_request(payload):
+    fields = payload.split(b'\0')
+    kind = fields[0].decode()
+    cwd = fields[1]
+    argc = int(fields[2])
+    argv = [os.fsdecode(arg) for arg in fields[3:3 + argc]]
+    env = dict(field.split(b'=', 1) for field in fields[3 + argc:])
+    return (kind, cwd, argv, env)
+
+
+def send_request(sock, kind, argv):
+    import array
+    import socket
+
+    data = encode_request(kind, argv)
+    fds = array.array('i', [0, 1, 2])
+    sent = sock.sendmsg([data],
+                       [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+    if sent < len(data):
+        sock.sendall(data[sent:])
+
+
+def wait_response(sock):
+    import signal
+
+    response = sock.makefile('rb')
+    pid = int(response.readline() or 0)
+    while True:
+        try:
+            code = response.readline()
+            break
+        except KeyboardInterrupt:
+            # the command is not in the foreground, so it is told instead
+            if pid:
+                os.kill(pid, signal.SIGINT)
+    # no exit code means the command did not finish normally
+    return int(code) if code else 1
+
+# ===========================================
+# Forwarding
+
+
+def _directory(words):
+    # given with --directory, before the command
+    for i, word in enumerate(words):
+        if word in ["--directory", "-d"]:
+            return words[i + 1] if i + 1 < len(words) else None
+        if not word.startswith("-"):
+            break
+    return None
+
+
+def connect(base_path):
+    path = server_path(base_path)
+    if not os.path.exists(path):
+        return None
+
+    import socket
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        # a server that is gone
+        sock.close()
+        return None
+    return sock
+
+
+def forward(kind, argv):
+    # returns the exit code, or None if there is no server to forward to
+    if kind == COMMAND and (os.isatty(0) or os.isatty(1)):
+        # the server is not in the foreground, it cannot use the terminal
+        return None
+
+    words = argv[2:] if kind == COMPLETION else argv
+    sock = connect(discover_base_path(_directory(words)))
+    if not sock:
+        return None
+
+    with sock:
+        send_request(sock, kind, argv)
+        return wait_response(sock)
@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 
-import json
 import os
 
+from .tracing import span
+
 # ===========================================
 # Constants
 
+ASYNC_HOOK_EXT = '.async'
 CURRENT = 'CURRENT'
 CURRENT_FN = '.current'
 FETCHER_FN = '.fetcher'
@@ -13,6 +15,7 @@ HOOKS_DIR = '.hooks'
 INDEX_FN = '.index'
 PREVIOUS = 'PREVIOUS'
 PREVIOUS_FN = '.previous'
+STREAM_FETCHER_FN = '.fetcher.stream'
 
 PROHIBITED_NAMES = (
     CURRENT,
@@ -22,6 +25,7 @@ PROHIBITED_NAMES = (
     INDEX_FN,
     PREVIOUS,
     PREVIOUS_FN,
+    STREAM_FETCHER_FN,
 )
 
 SEPARATOR_CHAR = '/'
@@ -35,20 +39,88 @@ DEFAULT_BASE_PATH = os.path.join('~', DEFAULT_BASE_DIR)
 SELECT_BACKWARD = 'forward'
 SELECT_FORWARD = 'backward'
 
+CACHE_DIR = 'dit'
+
+# ===========================================
+# Task Fields
+#
+# Exporters may declare the fields of the task data that they use, so that
+# only those are loaded. The "logbook" field may be given as "logbook:N" when
+# only the last N entries are used.
+
+FIELD_TITLE = 'title'
+FIELD_STATE = 'state'
+FIELD_DATES = 'dates'
+FIELD_TOTALS = 'totals'
+FIELD_LOGBOOK = 'logbook'
+FIELD_NOTES = 'notes'
+FIELD_PROPERTIES = 'properties'
+
+# ===========================================
+# Preloaded Files
+#
+# `dit serve` loads some files in advance and runs each command in a fork of
+# itself. A preloaded file is kept along with its stat, and it is only used
+# if the file still has the same stat. Since the command may modify what it
+# gets, each one is only used once.
+
+PRELOADED = {}
+
+
+def file_stamp(fp):
+    try:
+        stat = os.stat(fp)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def take_preloaded(fp):
+    if not PRELOADED:
+        return None
+    preloaded = PRELOADED.pop(os.path.abspath(fp), None)
+    if preloaded and preloaded[0] == file_stamp(fp):
+        return preloaded[1]
+    return None
+
 # ===========================================
 # Json Helpers
+#
+# json is imported when first used, so that completion, which does not need
+# it, does not pay for it.
 
 
 def load_json_file(fp):
+    data = take_preloaded(fp)
+    if data is not None:
+        return data
     if os.path.isfile(fp):
-        with open(fp, 'r') as f:
-            return json.load(f)
+        import json
+        with span("load_json_file", "storage", path=fp):
+            with open(fp, 'r') as f:
+                return json.load(f)
     return None
 
 
+def write_file(fp, content):
+    # to a temporary file renamed over it, so that it is never seen partially
+    # written (see locking)
+    directory, name = os.path.split(fp)
+    tmp_fp = os.path.join(directory, '.%s.%d.tmp' % (name, os.getpid()))
+    try:
+        with open(tmp_fp, 'w') as f:
+            f.write(content)
+        os.replace(tmp_fp, fp)
+    except BaseException:
+        if os.path.exists(tmp_fp):
+            os.remove(tmp_fp)
+        raise
+
+
 def save_json_file(fp, data):
-    with open(fp, 'w') as f:
-        f.write(json.dumps(data))
+    import json
+    with span("save_json_file", "storage", path=fp):
+        write_file(fp, json.dumps(data))
 
 # ===========================================
 # String Helpers
@@ -107,6 +179,20 @@ def discover_base_path(directory):
 
     return os.path.expanduser(directory)
 
+
+def cache_home():
+    home = (os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(home, CACHE_DIR)
+
+
+def cache_path(base_path):
+    import hashlib
+
+    # each dit directory gets its own cache directory
+    digest = hashlib.sha1(os.path.realpath(base_path).encode()).hexdigest()
+    return os.path.join(cache_home(), digest[:16])
+
 # ===========================================
 # Task Verification
 
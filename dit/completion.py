@@ -3,12 +3,12 @@
 import os
 
 from .common import (
-    ROOT_NAME_CHAR,
+    INDEX_FN,
     SELECT_BACKWARD,
     SELECT_FORWARD,
-    SEPARATOR_CHAR,
+    cache_path,
     discover_base_path,
-    load_json_file,
+    file_stamp,
     names_to_string,
     selector_split,
 )
@@ -17,102 +17,429 @@ from .common import (
 # Constants
 
 COMPLETION_SEP_CHAR = '\n'
-COMMAND_INFO_FN = 'command_info.json'
+COMMAND_INFO_FN = 'command_info.tsv'
 
 DIT_OPTIONS = [
+    "--cache-results",
     "--check-hooks",
     "--directory",
     "--help",
+    "--no-cache",
     "--no-hooks",
+    "--profile",
+    "--profile-json",
     "--verbose",
 ]
 
+WHERE_OPTIONS = ["--where", "-w"]
+TASK_OPTIONS = ["--task", "-t"]
+
 # ===========================================
-# Helpers
+# Command Info
+#
+# Kept in a plain text file, one command per line, with its fields separated
+# by tabs and its options by spaces, so that it is read without json.
+
+COMMAND_INFO_FIELDS = ['name', 'letter', 'select', 'readonly', 'options']
+
+NONE_FIELD = '-'
+
+
+def _command_info_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        COMMAND_INFO_FN)
 
 
 def _load_command_info():
-    fp = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                      COMMAND_INFO_FN)
-    return load_json_file(fp)
+    cmd_info = {}
+    with open(_command_info_path(), 'r') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            info = dict(zip(COMMAND_INFO_FIELDS, fields[1:]))
+            for name in ['letter', 'select']:
+                if info[name] == NONE_FIELD:
+                    info[name] = None
+            info['readonly'] = info['readonly'] == '1'
+            info['options'] = info['options'].split()
+            cmd_info[fields[0]] = info
+    return cmd_info
 
 
 def _save_command_info():
     from dit.dit import COMMAND_INFO
-    from dit.common import save_json_file
 
-    fp = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                      COMMAND_INFO_FN)
-    save_json_file(fp, COMMAND_INFO)
+    with open(_command_info_path(), 'w') as f:
+        for cmd, info in COMMAND_INFO.items():
+            f.write('\t'.join([
+                cmd,
+                info['name'],
+                info['letter'] or NONE_FIELD,
+                info['select'] or NONE_FIELD,
+                '1' if info['readonly'] else '0',
+                ' '.join(info['options']),
+            ]) + '\n')
 
 # ===========================================
-# Completion Modes
+# Completion Cache
+#
+# Completion candidates are kept in a file, one per line and sorted, so that
+# the ones starting with what is being completed are found with a binary
+# search. Each line starts with a tag for the kind of candidate, followed by
+# a tab. The first line holds the stat of the index the candidates come from,
+# and the file is written again whenever the index is saved, or when it is
+# found to be out of date.
+
+COMPLETION_FN = 'completion'
+
+# <group>/, <group>/<subgroup>/ and <group>/<subgroup>/<task>
+NAME_TAGS = ['n1', 'n2', 'n3']
+
+# same with the ids
+ID_TAGS = ['i1', 'i2', 'i3']
+
+
+def _completion_path(base_path):
+    return os.path.join(cache_path(base_path), COMPLETION_FN)
+
 
+def _completion_header(base_path):
+    stamp = file_stamp(os.path.join(base_path, INDEX_FN))
+    return '#%s' % ('%d %d' % tuple(stamp) if stamp else NONE_FIELD)
 
-def _gname(index, names):
+
+def _completion_lines(index_data):
     _ = names_to_string
 
-    names[-1] = None
-    names = names + [None] * (3 - len(names))
-    (group, subgroup, task) = names
-
-    comp_options = []
-    for i, g in enumerate(index):
-        if group is None:
-            comp_options.append(_(g[0]) + SEPARATOR_CHAR)
-        elif g[0] == group:
-            for j, s in enumerate(g[1]):
-                if subgroup is None:
-                    comp_options.append(_(g[0], s[0]) + SEPARATOR_CHAR)
-                elif s[0] == subgroup:
-                    for k, t in enumerate(s[1]):
-                        comp_options.append(_(g[0], s[0], t))
-                    break
+    n1, n2, n3 = NAME_TAGS
+    i1, i2, i3 = ID_TAGS
+
+    for i, g in enumerate(index_data):
+        yield '%s\t%s/' % (n1, _(g[0]))
+        yield '%s\t%d/' % (i1, i)
+        for j, s in enumerate(g[1]):
+            yield '%s\t%s/' % (n2, _(g[0], s[0]))
+            yield '%s\t%d/%d/' % (i2, i, j)
+            for k, t in enumerate(s[1]):
+                if t is None:
+                    continue
+                yield '%s\t%s' % (n3, _(g[0], s[0], t))
+                yield '%s\t%d/%d/%d' % (i3, i, j, k)
+
+
+def save_completion_cache(base_path, index_data=None):
+    # the header comes first, since the stat is taken before reading
+    lines = [_completion_header(base_path)]
+    if index_data is None:
+        from dit.index import Index
+        index = Index()
+        index.load(base_path)
+        index_data = index.data
+    lines += sorted(_completion_lines(index_data))
+    content = ('\n'.join(lines) + '\n').encode()
+
+    fp = _completion_path(base_path)
+    tmp_fp = '%s.%d' % (fp, os.getpid())
+    try:
+        if not os.path.exists(os.path.dirname(fp)):
+            os.makedirs(os.path.dirname(fp))
+        with open(tmp_fp, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_fp, fp)
+    except OSError:
+        # completion still works, from the returned content
+        pass
+    return content
+
+
+def _load_completion_cache(base_path):
+    import mmap
+
+    header = (_completion_header(base_path) + '\n').encode()
+    try:
+        with open(_completion_path(base_path), 'rb') as f:
+            content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # missing or empty
+        content = None
+    if content is None or content[:len(header)] != header:
+        content = save_completion_cache(base_path)
+    return content
+
+
+def _lookup(content, prefix):
+    # binary search of the first line not before the prefix
+    lo, hi = 0, len(content)
+    while lo < hi:
+        start = content.rfind(b'\n', 0, (lo + hi) // 2) + 1
+        end = content.find(b'\n', start)
+        if content[start:end] < prefix:
+            lo = end + 1
+        else:
+            hi = start
+
+    found = []
+    while lo < len(content):
+        end = content.find(b'\n', lo)
+        line = content[lo:end]
+        if not line.startswith(prefix):
             break
+        found.append(line[line.index(b'\t') + 1:])
+        lo = end + 1
+    return found
 
-    return COMPLETION_SEP_CHAR.join(comp_options)
 
+def complete(base_path, tag, word):
+    content = _load_completion_cache(base_path)
+    prefix = ('%s\t%s' % (tag, word)).encode()
+    return [line.decode() for line in _lookup(content, prefix)]
 
-def _selection(cmd, cmd_info, directory, selection):
+# ===========================================
+# Property Cache
+#
+# The properties of every task are kept in a map from the task selector to
+# its properties, from which the names and values are written, sorted, to a
+# file searched like the completion cache. Commands that save tasks update
+# the map with the properties of those tasks, so that completing never reads
+# a task file. The map is built from all the task files when it is missing.
 
-    names = selector_split(selection)
-    if len(names) > 3:
-        return ""
+PROPERTIES_FN = 'properties'
+PROPERTY_MAP_FN = 'properties.json'
 
-    path = discover_base_path(directory)
-    if not os.path.exists(path):
-        return ""
+PROPERTY_NAME_TAG = 'p'
+PROPERTY_VALUE_TAG = 'v'
 
-    from dit.index import Index
-    index = Index()
-    index.load(path)
 
-    select = cmd_info[cmd]['select']
+def _property_path(base_path):
+    return os.path.join(cache_path(base_path), PROPERTIES_FN)
 
-    if select in [SELECT_FORWARD, SELECT_BACKWARD]:
-        return _gname(index, names)
+
+def _property_map_path(base_path):
+    return os.path.join(cache_path(base_path), PROPERTY_MAP_FN)
+
+
+def _index_selectors(index_data):
+    _ = names_to_string
+    for g in index_data:
+        for s in g[1]:
+            for t in s[1]:
+                if t is not None:
+                    yield _(g[0], s[0], t)
+
+
+def _property_lines(property_map):
+    lines = set()
+    for properties in property_map.values():
+        for name, value in properties.items():
+            value = str(value)
+            # one per line, with the tab separating the name from the value
+            if '\t' in name or '\n' in name:
+                continue
+            lines.add('%s\t%s' % (PROPERTY_NAME_TAG, name))
+            if '\t' in value or '\n' in value:
+                continue
+            lines.add('%s\t%s\t%s' % (PROPERTY_VALUE_TAG, name, value))
+    return sorted(lines)
+
+
+def save_property_cache(base_path, updates, index_data, load_properties):
+    # `updates` are the properties of the tasks saved, by selector, and
+    # `load_properties(group, subgroup, task)` reads them from a task file
+    from .common import load_json_file, save_json_file
+
+    map_fp = _property_map_path(base_path)
+    if not updates and os.path.exists(map_fp):
+        return
+
+    try:
+        property_map = load_json_file(map_fp)
+    except ValueError:
+        property_map = None
+
+    selectors = set(_index_selectors(index_data))
+    if property_map is None:
+        property_map = {}
+        for selector in selectors - set(updates):
+            properties = load_properties(*selector_split(selector))
+            if properties:
+                property_map[selector] = properties
     else:
-        return ""
+        changed = set(property_map) - selectors
+        changed.update(selector for selector, properties in updates.items()
+                       if property_map.get(selector, {}) != properties)
+        if not changed:
+            return
+
+    for selector, properties in updates.items():
+        property_map.pop(selector, None)
+        if properties:
+            property_map[selector] = properties
+    property_map = {selector: properties
+                    for selector, properties in property_map.items()
+                    if selector in selectors}
+
+    content = ''.join(line + '\n' for line in _property_lines(property_map))
+    fp = _property_path(base_path)
+    tmp_fp = '%s.%d' % (fp, os.getpid())
+    try:
+        if not os.path.exists(os.path.dirname(fp)):
+            os.makedirs(os.path.dirname(fp))
+        save_json_file(map_fp, property_map)
+        with open(tmp_fp, 'w') as f:
+            f.write(content)
+        os.replace(tmp_fp, fp)
+    except OSError:
+        # properties are simply not completed
+        pass
+
+
+def forget_property_cache(base_path):
+    try:
+        os.remove(_property_map_path(base_path))
+    except OSError:
+        pass
+
+
+def _property_candidates(content, name, word):
+    if name is None:
+        prefix = '%s\t%s' % (PROPERTY_NAME_TAG, word)
+        return [line.decode() for line in _lookup(content, prefix.encode())]
+    prefix = '%s\t%s\t%s' % (PROPERTY_VALUE_TAG, name, word)
+    return [line.decode().split('\t', 1)[1]
+            for line in _lookup(content, prefix.encode())]
+
+
+def complete_property(base_path, name=None, word=''):
+    import mmap
+
+    try:
+        with open(_property_path(base_path), 'rb') as f:
+            content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # missing or empty
+        return []
+    return _property_candidates(content, name, word)
+
+# ===========================================
+# Sources
+#
+# Where the candidates for the tasks and the properties come from: the cache
+# files of the dit directory, or the state kept loaded by `dit shell`.
+
+
+class CacheSource:
+
+    def __init__(self, directory):
+        path = discover_base_path(directory)
+        self.base_path = path if os.path.exists(path) else None
+
+    def names(self, tag, word):
+        if not self.base_path:
+            return []
+        return complete(self.base_path, tag, word)
+
+    def properties(self, name, word):
+        if not self.base_path:
+            return []
+        return complete_property(self.base_path, name, word)
+
+
+class ShellCompleter:
+
+    def __init__(self, dit, cmd_info):
+        self.dit = dit
+        self.cmd_info = cmd_info
+        self.content = None
+        self.property_content = None
+        self.property_stamp = None
+        self.matches = []
+
+    def invalidate(self):
+        # after the state changes
+        self.content = None
+        self.property_content = None
+
+    def names(self, tag, word):
+        if self.content is None:
+            lines = sorted(_completion_lines(self.dit.index.data))
+            self.content = ''.join(line + '\n' for line in lines).encode()
+        prefix = ('%s\t%s' % (tag, word)).encode()
+        return [line.decode() for line in _lookup(self.content, prefix)]
+
+    def properties(self, name, word):
+        fp = _property_path(self.dit.base_path)
+        stamp = file_stamp(fp)
+        if self.property_content is None or stamp != self.property_stamp:
+            try:
+                with open(fp, 'rb') as f:
+                    self.property_content = f.read()
+            except OSError:
+                self.property_content = b''
+            self.property_stamp = stamp
+        return _property_candidates(self.property_content, name, word)
+
+    def complete(self, text, state):
+        # as expected by `readline.set_completer`
+        if state == 0:
+            import readline
+
+            if self.dit._refresh_state():
+                self.invalidate()
+
+            words = readline.get_line_buffer()[:readline.get_begidx()].split()
+            line = words + [text]
+            candidates = complete_line(line, len(words), self.cmd_info,
+                                       lambda directory: self)
+            self.matches = [c for c in candidates if c.startswith(text)]
+        return self.matches[state] if state < len(self.matches) else None
 
+# ===========================================
+# Completion Modes
 
-def _cmd_name(cmd_info):
-    return COMPLETION_SEP_CHAR.join([cmd for cmd in cmd_info])
 
+def _selection(cmd, cmd_info, source, selection):
 
-def _cmd_option(cmd, cmd_info):
-    return COMPLETION_SEP_CHAR.join(cmd_info[cmd]['options'])
+    names = selector_split(selection)
+    if len(names) > 3:
+        return []
 
+    select = cmd_info[cmd]['select']
 
-def _dit_option():
-    return COMPLETION_SEP_CHAR.join(DIT_OPTIONS)
+    if select in [SELECT_FORWARD, SELECT_BACKWARD]:
+        tags = ID_TAGS if selection[:1].isdigit() else NAME_TAGS
+        tag = tags[len(names) - 1]
+        return source.names(tag, selection)
+    else:
+        return []
+
+
+def _argument(cmd, cmd_info, source, args, word):
+    # `args` are the words between the command and the one completed
+    if len(args) >= 1 and args[-1] in WHERE_OPTIONS:
+        return source.properties(None, word)
+    if len(args) >= 2 and args[-2] in WHERE_OPTIONS:
+        return source.properties(args[-1], word)
+
+    if cmd_info[cmd]['name'] == 'set':
+        if len(args) >= 1 and args[-1] in TASK_OPTIONS:
+            return _selection(cmd, cmd_info, source, word)
+        # "name" and "value" follow the task, if any
+        if len(args) >= 2 and args[0] in TASK_OPTIONS:
+            args = args[2:]
+        if len(args) == 0:
+            return source.properties(None, word)
+        if len(args) == 1:
+            return source.properties(args[0], word)
+        return []
+
+    return _selection(cmd, cmd_info, source, word)
 
 # ===========================================
 # Entry point
 
 
-def interpret(argv):
-    idx = int(argv.pop(0)) - 1
-    line = argv[1:]
+def complete_line(line, idx, cmd_info, make_source=CacheSource):
+    # the candidates for the word at `idx` in the words after "dit", where
+    # `make_source` gives the source of the dit directory selected
     cmd = None
     directory = None
 
@@ -126,25 +453,25 @@ def interpret(argv):
             break
         i += 1
 
-    cmd_info = _load_command_info()
     if cmd and cmd not in cmd_info:
-        return ""
+        return []
 
     word = line[idx] if len(line) > idx else ""
-    comp_options = ""
+    args = line[i + 1:idx]
 
-    if word == "" or word[0].isalpha():
-        if cmd:
-            comp_options = _selection(cmd, cmd_info, directory, word)
-        else:
-            comp_options = _cmd_name(cmd_info)
-    elif word.startswith((ROOT_NAME_CHAR, SEPARATOR_CHAR)):
-        if cmd:
-            comp_options = _selection(cmd, cmd_info, directory, word)
-    elif word.startswith('-'):
+    if word.startswith('-'):
         if cmd:
-            comp_options = _cmd_option(cmd, cmd_info)
-        else:
-            comp_options = _dit_option()
+            return cmd_info[cmd]['options']
+        return DIT_OPTIONS
+    elif cmd:
+        return _argument(cmd, cmd_info, make_source(directory), args, word)
+    elif word == "" or word[0].isalpha():
+        return list(cmd_info)
+    return []
 
-    return comp_options
+
+def interpret(argv):
+    idx = int(argv.pop(0)) - 1
+    line = argv[1:]
+    cmd_info = _load_command_info()
+    return COMPLETION_SEP_CHAR.join(complete_line(line, idx, cmd_info))
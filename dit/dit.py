@@ -17,11 +17,41 @@ Usage: dit [--verbose, -v] [--directory, -d "path"] <command>
     Prints this message and quits.
 
   --check-hooks
-    Stop with error when hook process fails.
+    Stop with error when hook process fails. Asynchronous hooks are run
+    synchronously then.
 
   --no-hooks
     Disable the use of hooks.
 
+  --no-cache
+    Do not use the cache of parsed task files. The cache is kept in
+    "$XDG_CACHE_HOME/dit" and task files are parsed again whenever they
+    change.
+
+  --cache-results
+    Reuse the output of a previous run of the same listing command, as long
+    as no dit command modified the dit directory since then. Time spent on
+    tasks being clocked is brought up to date.
+
+  --profile
+    Prints to stderr how long each phase of the command took, and how many
+    times it ran: hooks, loading of the state and of the task files, date
+    conversion and exporter calls.
+
+  --profile-json "file"
+    Same as "--profile", but writes the phases and each of their calls to
+    "file" as JSON instead.
+
+  If the environment variable DIT_TRACE gives a file, spans of the command
+  (file reads and writes, filters, exporter calls, hooks and fetchers) are
+  appended to it as Chrome trace events, to be opened in a trace viewer.
+
+  Several dit processes may run at once on the same dit directory. A command
+  that modifies a task waits for the others that modify it to be done, for
+  up to $DIT_LOCK_TIMEOUT seconds (10 by default), but none undoes the tasks
+  added to the index or the previous stack by another one. Listing commands
+  wait for the index and the state files to be written.
+
   Workflow <command>'s:
 
     new [--fetch, -f] <name> ["title"]
@@ -66,7 +96,9 @@ Usage: dit [--verbose, -v] [--directory, -d "path"] <command>
   Listing <command>'s:
 
     export [--all, -a] [--concluded, -c] [--compact, -z]
-           [--output, -o "file"] [--format, -f "format"] [<gid> | <gname>]
+           [--limit, -l N] [--sort "key"]
+           [--output, -o "file"] [--format, -f "format"]
+           [--incremental [--state-file "file"]] [<gid> | <gname>]
       Prints most information of the CURRENT subgroup or the selected one.
       --all, -a
         Select all groups and subgroups.
@@ -74,11 +106,25 @@ Usage: dit [--verbose, -v] [--directory, -d "path"] <command>
         Include concluded tasks.
       --compact, -z
         Make the output more compact.
+      --limit, -l N
+        Only export the first N tasks.
+      --sort "key"
+        Export the tasks ordered by "key", which is one of: "recent" (most
+        recently modified first), "time-spent" (most time spent first),
+        "created" (most recently created first) or "title". Implies
+        "--compact".
       --output, -o "file-name"
         File to which to write. Defaults to "stdout".
       --format, -f "format"
         Format to use. If not provided, the format is deduced from the file
         extension if present, else it defaults to dit's own format.
+      --incremental
+        Only export again the groups with tasks that changed since the last
+        incremental export, reusing the output of the others. What is needed
+        for that is kept in a state file.
+      --state-file "file"
+        State file to use with "--incremental". Defaults to the output file
+        name followed by ".state".
 
       For a given format, dit will try to use an external exporter plugin
       first. It will fallback to an internal exporter if possible or fail if
@@ -87,8 +133,10 @@ Usage: dit [--verbose, -v] [--directory, -d "path"] <command>
     list
       This is a convenience alias for "export --output stdout --format dit".
 
-    status
+    status [--limit, -l, -n N]
       Prints an overview of the data for the CURRENT and PREVIOUS tasks.
+      --limit, -l, -n N
+        Only print the first N of them, at least one.
 
     Note that these commands also accept the following options:
     --verbose, -v
@@ -105,8 +153,15 @@ Usage: dit [--verbose, -v] [--directory, -d "path"] <command>
 
   Task editing <command>'s:
 
-    fetch <name>
+    fetch <name> | [--jobs, -j N] --all, -a | --group, -g <gname>
       Use data fetcher plugin.
+      --all, -a
+        Fetch the data of all the tasks of the groups that have a data
+        fetcher, with up to N fetchers running at once (4 by default). The
+        files are written once all are done, and each task is reported as
+        fetched or failed, after the output of its fetcher.
+      --group, -g <gname>
+        The same, for the tasks of the given group or subgroup.
 
     move [--fetch, -f] <name> <name>
       Rename task or change its group and/or subgroup.
@@ -132,6 +187,46 @@ Usage: dit [--verbose, -v] [--directory, -d "path"] <command>
       Rebuild the ".index" file. For use in case of manual modification of the
       contents of the dit directory.
 
+    batch [--stop-on-error] [--command-hooks] ["file" | -]
+      Runs the commands in "file" or, by default, read from stdin. Each line
+      is a command with its arguments, as given to "dit" after its options.
+      Empty lines and comments starting with "#" are skipped. The files are
+      written once the batch is done, although listing commands and
+      "rebuild-index" see the changes made before them. Hooks are called for
+      "batch" only. Failing commands are reported with their line number and
+      the following ones are still run.
+      --stop-on-error
+        Stop at the first failing command.
+      --command-hooks
+        Also call the hooks for each command.
+
+    plugins
+      Lists the exporters, by format, and the Python hooks of the installed
+      packages, with the module each is loaded from and how long loading it
+      took.
+
+    shell
+      Reads commands interactively, written as for "batch", until "exit",
+      "quit" or the end of the input. The state stays loaded between the
+      commands and is only loaded again when its files change. Commands and
+      their arguments are completed with TAB.
+
+    hooks [status | drain | retry]
+      Manages the queues of the asynchronous hooks (see Hooks). "status", the
+      default, tells whether their worker is running and how many events are
+      pending or failed for each hook. "drain" runs the pending events, after
+      waiting for the worker if it is running. "retry" queues again the
+      events that failed.
+
+    serve [--stop]
+      Keeps running, with the state of the dit directory loaded, to run the
+      commands given to it. While it runs, "dit" forwards the commands to it
+      unless stdin or stdout is a terminal, which it cannot use, and
+      "dit-completion" always does. Output and exit codes are the same as
+      without it. It must be restarted when dit is upgraded.
+      --stop
+        Stop the running server.
+
   Plugins:
 
     Data fetcher:
@@ -141,12 +236,33 @@ Usage: dit [--verbose, -v] [--directory, -d "path"] <command>
         "$ .fetcher dit-directory group subgroup task"
       It should save the fetched data in the file:
         "dit-directory/group/subgroup/task.json"
+      A script named ".fetcher.stream" is used instead when it is in the
+      same directory or a nearer one. It is started once by a command, and
+      kept for the whole of a batch or a shell, as:
+        "$ .fetcher.stream dit-directory"
+      For each task to fetch, it is given a line of JSON on stdin, such as
+      {"id": 1, "group": "g", "subgroup": "s", "task": "t"}, and should
+      write a line of JSON on stdout with the same "id" and either the
+      fetched data, as "data", or an error message, as "error". It may
+      answer in any order, should write anything else to stderr, and
+      should exit at the end of its stdin.
+      A fetcher that takes more than $DIT_FETCH_TIMEOUT seconds (60 by
+      default) to fetch the data of a task is killed, and the fetch fails.
+      What was fetched for a task is kept in the cache and used instead of
+      calling the fetcher again for $DIT_FETCH_TTL seconds (none by default).
+      Fetched data may come with a validator string, as "validator" in the
+      file or the response, which is given back to the fetcher the next
+      time, as $DIT_FETCH_VALIDATOR or as "validator" in the request. The
+      fetcher may then answer that the data was not modified, by writing no
+      file or with {"id": 1, "not_modified": true}, and the cached data is
+      used.
 
     Exporter:
       This allows specifying custom formats for the export command.
-      The plugin should be installed as a Python module whose name has the
-      following format "dit_Xexporter" where "X" will be the format specified
-      by "--format X" in the export command call.
+      The plugin should be installed as a Python module given by an entry
+      point of the group "dit.exporters" named "X", where "X" will be the
+      format specified by "--format X" in the export command call, or else
+      as a module whose name has the format "dit_Xexporter".
       The following methods should be available in the module:
         - setup(file, options)
         - begin()
@@ -154,6 +270,16 @@ Usage: dit [--verbose, -v] [--directory, -d "path"] <command>
         - group(group, group_id)
         - subgroup(group, group_id, subgroup, subgroup_id)
         - task(group, group_id, subgroup, subgroup_id, task, task_id, data)
+      If the module sets "DATETIMES = True", the dates in "data" are given as
+      "datetime" objects instead of strings.
+      The module may also provide "fields()", called after "setup", which
+      returns the fields of "data" used by "task" among: "title", "state",
+      "dates", "totals", "logbook" (or "logbook:N" for the last N entries),
+      "notes" and "properties". Only those are then loaded, with the dates
+      as "datetime" objects, and "totals" are given as "time_spent" when the
+      logbook is not complete. If no field is needed, no task file is read.
+      The module may trace parts of its work with the context manager
+      "dit.tracing.span(name, category, **args)" (see DIT_TRACE).
 
     Hooks:
       Hooks are scripts that can be called before and after a command. The
@@ -167,6 +293,27 @@ Usage: dit [--verbose, -v] [--directory, -d "path"] <command>
       The script should be installed in the ".hooks" directory in your dit
       directory and it will be called in the following manner:
         "$ hook-name dit-directory command-name"
+      It gets the event of the hook as JSON, in a temporary file whose path
+      is in $DIT_HOOK_EVENT, and keeps the stdin of dit. The keys are:
+      "hook", "command", "directory", "readonly", "tasks" (the selectors of
+      the tasks created, modified or removed by the command), "before" and
+      "after" (the data of those tasks before and after the command, by
+      selector, or null), and "current" and "previous" (the content of the
+      CURRENT and PREVIOUS files, as {"before": ..., "after": ...}). Those
+      of the before hooks only tell the command.
+      The after hooks may also run detached from the command, as scripts
+      named "after.async", "after_read.async" or "after_write.async". Their
+      events are queued in ".hooks/spool" and run in the background by a
+      worker, in order for each hook and for up to $DIT_HOOK_JOBS (4 by
+      default) hooks at once. A failing event is retried 3 times before it
+      is set aside as failed. The output goes to ".hooks/spool/worker.log".
+      Hooks may also be Python functions named after the hook, defined in
+      ".hooks/hooks.py" or in the modules given by the "dit.hooks" entry
+      points of installed packages, which are only used by the dit
+      directories that have a ".hooks" directory, even an empty one. They
+      are called after the scripts, in the dit process, with the event as an
+      object whose attributes are its keys. Failing ones are reported as
+      warnings.
 
   Clarifications:
 
@@ -194,19 +341,21 @@ Usage: dit [--verbose, -v] [--directory, -d "path"] <command>
   <gid>: "group-id"[/"subgroup-id"[/"task-id"]]
 """
 
+import heapq
+import io
 import json
 import os
 import re
-import subprocess
 import sys
+import time
 
+from copy import deepcopy
+from datetime import datetime
 from enum import Enum
-from getpass import getuser
-from importlib import import_module
-from importlib.util import find_spec
-from tempfile import gettempdir
+from functools import partial
 
 from . import messages as msg
+from . import tracing
 
 from .exceptions import (
     DitError,
@@ -214,34 +363,73 @@ from .exceptions import (
     NoTaskSpecifiedError,
     SubprocessError,
     maybe_raise_unrecognized_argument,
+    pop_int,
+    pop_positive_int,
+)
+from .utils import (
+    apply_filters,
+    convert_datetimes,
+    dt2str,
+    filter_fields,
+    interpret_date,
+    is_relative_to_now,
+    is_summary_projection,
+    merge_fields,
+    now,
+    now_str,
+    parse_fields,
+    project,
+    render_live,
+    time_spent_on,
 )
-from .utils import now_str, interpret_date, dt2str
 
 from .common import (
+    ASYNC_HOOK_EXT,
     CURRENT,
     CURRENT_FN,
     FETCHER_FN,
+    FIELD_DATES,
+    FIELD_STATE,
+    FIELD_TITLE,
+    FIELD_TOTALS,
     HOOKS_DIR,
     PREVIOUS,
     PREVIOUS_FN,
     ROOT_NAME,
     SELECT_BACKWARD,
     SELECT_FORWARD,
+    STREAM_FETCHER_FN,
     discover_base_path,
+    file_stamp,
     is_valid_task_name,
     load_json_file,
     names_to_string,
     path_to_string,
     save_json_file,
     selector_split,
+    write_file,
 )
 
 from .index import Index
+from .tracing import span
 
 # ===========================================
 # Constants
 
 COMMENT_CHAR = "#"
+SHELL_PROMPT = "dit> "
+STATE_FILE_EXT = ".state"
+STATE_FILE_VERSION = 1
+
+# the commands that manage the hooks do not call them
+UNHOOKED_COMMANDS = ["hooks"]
+
+# those that keep running hold no lock, only their commands do, nor does
+# "hooks", whose hooks may run dit
+UNLOCKED_COMMANDS = ["hooks", "serve", "shell"]
+
+# fetchers run at once by "fetch --all"
+DEFAULT_FETCH_JOBS = 4
 
 # ===========================================
 # Enumerators
@@ -259,6 +447,21 @@ class State(Enum):
 
 HOOKS_ENABLED = True
 CHECK_HOOKS = False
+CACHE_RESULTS = False
+TASK_CACHE_ENABLED = True
+
+
+def reset_general_options():
+    # for the commands run by `dit serve`, which may have its own
+    global HOOKS_ENABLED
+    global CHECK_HOOKS
+    global CACHE_RESULTS
+    global TASK_CACHE_ENABLED
+    HOOKS_ENABLED = True
+    CHECK_HOOKS = False
+    CACHE_RESULTS = False
+    TASK_CACHE_ENABLED = True
+    msg.turn_verbose_off()
 
 # ===========================================
 # System
@@ -272,22 +475,116 @@ def get_system_editor():
     return editor
 
 
-def run_subprocess(*args, **kwargs):
+# Modules only needed by a few commands are imported when first used, so that
+# they do not slow down the startup of all the others.
+
+
+def run_subprocess(cmd, description=None, **kwargs):
+    import subprocess
     if not sys.stdout.isatty():
         sys.stdout.flush()
-    return subprocess.run(*args, **kwargs)
+    try:
+        return subprocess.run(cmd, **kwargs)
+    except subprocess.CalledProcessError:
+        raise SubprocessError(description or cmd[0])
+
+
+# ===========================================
+# Profiling
+#
+# With --profile, the phases of the command are measured: the hooks, the
+# loading of the state and of the tasks, the conversion of their dates and
+# the calls to the exporter.
+
+
+def start_profiler():
+    from .profiling import Profiler
+
+    profiler = Profiler()
+    module = sys.modules[__name__]
+    profiler.patch(Dit, '_call_hook',
+                   lambda dit, hook, *args: "hook %s" % hook)
+    profiler.patch(Dit, '_load_current', "_load_current")
+    profiler.patch(Dit, '_load_previous', "_load_previous")
+    profiler.patch(Dit, '_load_task_data', "_load_task_data")
+    profiler.patch(Dit, '_read_task_file', "_read_task_file")
+    profiler.patch(Index, 'load', "index.load")
+    original_convert_datetimes = convert_datetimes
+    profiler.patch(module, 'convert_datetimes', "convert_datetimes")
+
+    original_load_plugin = load_plugin
+
+    def load_measured_plugin(plugin_name):
+        plugin = original_load_plugin(plugin_name)
+        if plugin_name.endswith("_exporter"):
+            profiler.patch_exporter(plugin)
+            # the exporters may convert the dates themselves
+            if getattr(plugin, 'convert_datetimes',
+                       None) is original_convert_datetimes:
+                profiler.patch(plugin, 'convert_datetimes',
+                               "convert_datetimes")
+        return plugin
+
+    profiler.patched.append((module, 'load_plugin', original_load_plugin))
+    module.load_plugin = load_measured_plugin
+    return profiler
+
+
+# ===========================================
+# Plugins
+#
+# An exporter is found by its format among the entry points "dit.exporters"
+# of the installed distributions, or else as a module "dit_Xexporter", or
+# else among those of dit. What is found is kept by the registry.
+
+EXPORTER_SUFFIX = "_exporter"
+
+
+def find_plugin(plugin_name):
+    # "module:attribute" or the name of the module, `None` when not found
+    from .registry import EXPORTERS_ENTRY_POINTS, entry_points, module_exists
+
+    if plugin_name.endswith(EXPORTER_SUFFIX):
+        output_format = plugin_name[:-len(EXPORTER_SUFFIX)]
+        value = entry_points(EXPORTERS_ENTRY_POINTS).get(output_format)
+        if value:
+            return value
+    for module_name in ["dit_%s" % plugin_name, "dit.%s" % plugin_name]:
+        if module_exists(module_name):
+            return module_name
+    return None
+
+
+def exporter_formats():
+    import pkgutil
+    from .registry import EXPORTERS_ENTRY_POINTS, entry_points
+
+    formats = set(entry_points(EXPORTERS_ENTRY_POINTS))
+    modules = [("dit_", pkgutil.iter_modules()),
+               ("", pkgutil.iter_modules([os.path.dirname(__file__)]))]
+    for prefix, module_infos in modules:
+        for module_info in module_infos:
+            name = module_info.name
+            if name.startswith(prefix) and name.endswith(EXPORTER_SUFFIX):
+                formats.add(name[len(prefix):-len(EXPORTER_SUFFIX)])
+    return sorted(name for name in formats if name)
 
 
 def load_plugin(plugin_name):
-    external = "dit_%s" % plugin_name
-    if find_spec(external):
-        return import_module(external)
-    internal = "dit.%s" % plugin_name
-    if find_spec(internal):
-        return import_module(internal)
-    raise DitError("Plugin module not found: %s "
-                   "Your dit installation might be corrupt."
-                   % plugin_name)
+    from .registry import load_entry_point
+
+    value = find_plugin(plugin_name)
+    if value is None:
+        raise DitError("Plugin module not found: %s "
+                       "Your dit installation might be corrupt."
+                       % plugin_name)
+    try:
+        plugin = load_entry_point(value)
+    except Exception as err:
+        raise DitError("Could not load the plugin `%s`: %s" % (value, err))
+    if tracing.enabled():
+        return tracing.TracedModule(plugin, "exporter")
+    return plugin
 
 # ===========================================
 # Command decorator
@@ -308,6 +605,8 @@ LIST_OPTIONS = FILTER_OPTIONS + [
     "--all",
     "--concluded",
     "--compact",
+    "--limit",
+    "--sort",
 ]
 
 
@@ -365,11 +664,15 @@ def selector_to_tuple(string, kind=NAME_SELECTOR):
 
 def make_dirs(path):
     if not os.path.exists(path):
-        os.makedirs(path)
+        # unless created meanwhile by another dit process
+        os.makedirs(path, exist_ok=True)
         msg.verbose("Created: %s" % path_to_string(path))
 
 
 def make_tmp_fp(name, extension):
+    from getpass import getuser
+    from tempfile import gettempdir
+
     name = re.sub(r'[^_A-Za-z0-9]', '_', name).strip('_') + '.' + extension
 
     path = os.path.join(gettempdir(), getuser(), "dit")
@@ -388,10 +691,8 @@ def prompt(header, initial=None, extension='txt'):
                 f.write(COMMENT_CHAR + ' ' + header + '\n')
                 if initial:
                     f.write(initial)
-            try:
-                run_subprocess([editor, input_fp], check=True)
-            except subprocess.CalledProcessError:
-                raise SubprocessError("%s %s" % (editor, input_fp))
+            run_subprocess([editor, input_fp],
+                           "%s %s" % (editor, input_fp), check=True)
             with open(input_fp, 'r') as f:
                 lines = [line for line in f.readlines()
                          if not line.startswith(COMMENT_CHAR)]
@@ -552,6 +853,115 @@ def data_update(current, other):
 
     return current
 
+# ===========================================
+# Previous stack changes
+
+def _stack_add(stack, selector):
+    stack.append(selector)
+
+
+def _stack_remove(stack, selector):
+    stack[:] = [i for i in stack if i != selector]
+
+
+def _stack_pop(stack, selector):
+    # the last one, which may no longer be on top once merged
+    for i in reversed(range(len(stack))):
+        if stack[i] == selector:
+            del stack[i]
+            break
+
+
+def _stack_replace(stack, from_selector, to_selector):
+    for i in range(len(stack)):
+        if stack[i] == from_selector:
+            stack[i] = to_selector
+            break
+
+# ===========================================
+# Sorting
+
+# keys are such that smaller is listed first
+
+SORT_RECENT = 'recent'
+SORT_TIME_SPENT = 'time-spent'
+SORT_CREATED = 'created'
+SORT_TITLE = 'title'
+
+
+def sort_key_recent(task_fp):
+    return -os.stat(task_fp).st_mtime_ns
+
+
+def sort_key_time_spent(data):
+    time_spent = data.get('time_spent') or time_spent_on(data.get('logbook', []))
+    return -time_spent.total_seconds()
+
+
+def sort_key_created(data):
+    created_at = data.get('created_at')
+    if created_at is None:
+        return (True, 0)
+    return (False, -created_at.timestamp())
+
+
+def sort_key_title(data):
+    title = data.get('title')
+    return (title is None, (title or '').casefold())
+
+
+SORT_KEYS = {
+    SORT_RECENT: sort_key_recent,
+    SORT_TIME_SPENT: sort_key_time_spent,
+    SORT_CREATED: sort_key_created,
+    SORT_TITLE: sort_key_title,
+}
+
+# these are computed from the task path, without reading the task file
+CHEAP_SORT_KEYS = [SORT_RECENT]
+
+SORT_FIELDS = {
+    SORT_RECENT: [],
+    SORT_TIME_SPENT: [FIELD_TOTALS],
+    SORT_CREATED: [FIELD_DATES],
+    SORT_TITLE: [FIELD_TITLE],
+}
+
+# ===========================================
+# Incremental Export
+
+
+def export_key(output_format, options, group, subgroup):
+    key_options = {}
+    for name, value in options.items():
+        if name == 'filters':
+            value = {f: [v[0], v[1].pattern] if f == 'where' else dt2str(v)
+                     for f, v in value.items()}
+        key_options[name] = value
+    return [output_format, key_options, group, subgroup]
+
+
+def task_fingerprint(task_fp, previous=None, checked_ns=0):
+    # [mtime_ns, size, sha1]; the content is only hashed when the stat
+    # information is not enough to tell that the file is unchanged
+    import hashlib
+    from .cache import TASK_CACHE_RACY_NS
+
+    stat = os.stat(task_fp)
+    fingerprint = [stat.st_mtime_ns, stat.st_size]
+    if previous and previous[:2] == fingerprint and \
+            checked_ns - stat.st_mtime_ns > TASK_CACHE_RACY_NS:
+        return previous
+    with open(task_fp, 'rb') as f:
+        return fingerprint + [hashlib.sha1(f.read()).hexdigest()]
+
+
+def take_text(buffer):
+    text = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return text
+
 # ===========================================
 # Dit Class
 
@@ -563,12 +973,34 @@ class Dit:
     current_task = None
     current_halted = True
 
-    previous_stack = []
-
-    index = Index()
-
     base_path = None
     exporter = None
+    mark_live = False
+    task_cache = None
+    pending = None
+    state_stamps = None
+    export_options = {}
+    export_fields = None
+    export_limit = 0
+    export_count = 0
+    fetch_cache = None
+    task_locks = None
+    previous_stamp = None
+    previous_unsaved = False
+    hook_scan = None
+    hook_names = frozenset()
+    python_hooks = None
+    record_changes = False
+    spooled = False
+
+    def __init__(self):
+        self.previous_stack = []
+        self.previous_changes = []
+        self.index = Index()
+        self.property_updates = {}
+        self.changes = []
+        self.plugin_paths = {}
+        self.stream_fetchers = {}
 
     # ===========================================
     # Paths and files names
@@ -589,24 +1021,31 @@ class Dit:
         return os.path.join(self.base_path, HOOKS_DIR, hook)
 
     def _plugin_path(self, name, group, subgroup):
+        # kept for the commands of a batch, e.g. fetching many tasks
+        key = (name, group, subgroup)
+        if key in self.plugin_paths:
+            return self.plugin_paths[key]
         try_paths = [
             os.path.join(self.base_path, group, subgroup, name),
             os.path.join(self.base_path, group, name),
             os.path.join(self.base_path, name),
         ]
+        found = None
         for path in try_paths:
             if os.path.isfile(path):
-                return path
-        return None
+                found = path
+                break
+        self.plugin_paths[key] = found
+        return found
 
     def _raise_task_exists(self, group, subgroup, task):
         path = os.path.join(self.base_path, group, subgroup, task)
-        if os.path.exists(path):
+        if self._is_file(path) or os.path.isdir(path):
             raise DitError("Task already exists: %s" % path)
 
     def _get_task_path(self, group, subgroup, task):
         path = os.path.join(self.base_path, group, subgroup, task)
-        if not os.path.isfile(path):
+        if not self._is_file(path):
             raise DitError("No such task file: %s" % path)
         return path
 
@@ -615,6 +1054,80 @@ class Dit:
         make_dirs(path)
         return os.path.join(path, task)
 
+    # ===========================================
+    # Files
+    #
+    # While running a batch, the files are kept in `pending` as they would be
+    # written (or `None` once removed), and written when the batch is done.
+
+    def _write_json(self, fp, data):
+        if self.pending is None:
+            save_json_file(fp, data)
+        else:
+            self.pending[fp] = json.dumps(data)
+
+    def _read_json(self, fp):
+        if self.pending is None or fp not in self.pending:
+            return load_json_file(fp)
+        content = self.pending[fp]
+        return None if content is None else json.loads(content)
+
+    def _remove_file(self, fp):
+        if self.pending is None:
+            os.remove(fp)
+        else:
+            self.pending[fp] = None
+
+    def _is_file(self, fp):
+        if self.pending is None or fp not in self.pending:
+            return os.path.isfile(fp)
+        return self.pending[fp] is not None
+
+    def _write_pending(self):
+        from .locking import directory_lock
+
+        with span("write pending", "storage", files=len(self.pending)), \
+                directory_lock(self.base_path).writing():
+            for fp, content in self.pending.items():
+                if content is not None:
+                    write_file(fp, content)
+                elif os.path.isfile(fp):
+                    os.remove(fp)
+            self.pending.clear()
+            self.index.flush()
+            if self.previous_unsaved:
+                self.previous_unsaved = False
+                self._write_previous()
+
+    def _write_state(self, fp, data):
+        from .locking import directory_lock
+
+        with directory_lock(self.base_path).writing():
+            self._write_json(fp, data)
+
+    # ===========================================
+    # Locks (see locking)
+
+    def _run_locked(self, cmd_name, argv, readonly_cmd):
+        from .locking import TaskLocks, directory_lock
+
+        if cmd_name in UNLOCKED_COMMANDS:
+            getattr(self, cmd_name)(argv)
+        elif readonly_cmd:
+            with directory_lock(self.base_path).reading():
+                getattr(self, cmd_name)(argv)
+        else:
+            self.task_locks = TaskLocks()
+            try:
+                getattr(self, cmd_name)(argv)
+            finally:
+                self.task_locks.release()
+                self.task_locks = None
+
+    def _lock_task(self, task_fp):
+        if self.task_locks is not None:
+            self.task_locks.lock(task_fp)
+
     # ===========================================
     # Checks
 
@@ -626,27 +1139,96 @@ class Dit:
     # ===========================================
     # Task management
 
-    def _load_task_data(self, group, subgroup, task):
-        task_fp = self._get_task_path(group, subgroup, task)
-        data = load_json_file(task_fp)
+    def _read_task_file(self, task_fp):
+        data = self._read_json(task_fp)
         if not is_valid_task_data(data):
             raise DitError("Task file contains invalid data: %s"
                            % task_fp)
         return data
 
+    def _read_converted_task_file(self, task_fp):
+        return convert_datetimes(self._read_task_file(task_fp))
+
+    def _load_task_data(self, group, subgroup, task, converted=False):
+        task_fp = self._get_task_path(group, subgroup, task)
+        self._lock_task(task_fp)
+        if not converted:
+            return self._read_task_file(task_fp)
+        if self.task_cache is None:
+            return self._read_converted_task_file(task_fp)
+        return self.task_cache.get(task_fp, self._read_converted_task_file)
+
     def _save_task(self, group, subgroup, task, data):
         task_fp = self._make_task_path(group, subgroup, task)
+        self._lock_task(task_fp)
         data['updated_at'] = now_str()
-        save_json_file(task_fp, data)
+        self._record_change(group, subgroup, task, task_fp, data)
+        self._write_json(task_fp, data)
+        self._property_update(group, subgroup, task, data)
         msg.verbose("Task saved: %s" % _(group, subgroup, task))
 
     def _create_task(self, group, subgroup, task, data):
         task_fp = self._make_task_path(group, subgroup, task)
+        self._lock_task(task_fp)
         data['created_at'] = now_str()
-        save_json_file(task_fp, data)
+        self._record_change(group, subgroup, task, task_fp, data)
+        self._write_json(task_fp, data)
+        self._property_update(group, subgroup, task, data)
         self.index.add(group, subgroup, task)
         self.index.save()
 
+    # Changes of the tasks and of the state, for the after hooks; one record
+    # for each command whose hooks are running, e.g. a batch and one of its
+    # commands
+
+    def _record(self, kind, key, fp, data):
+        records = [getattr(changes, kind) for changes in self.changes]
+        after = deepcopy(data)
+        before = None
+        if any(key not in record for record in records) and self._is_file(fp):
+            before = self._read_json(fp)
+        for record in records:
+            record.setdefault(key, [before, None])[1] = after
+
+    def _record_change(self, group, subgroup, task, task_fp, data):
+        if self.changes:
+            self._record('tasks', _(group, subgroup, task), task_fp, data)
+
+    def _hook_state(self, changes):
+        state = {}
+        for name, fp in [('current', self._current_path()),
+                         ('previous', self._previous_path())]:
+            if name in changes.state:
+                before, after = changes.state[name]
+            else:
+                before = after = self._read_json(fp)
+            state[name] = {'before': before, 'after': after}
+        return state
+
+    # Properties of the tasks saved, for completion
+
+    def _property_update(self, group, subgroup, task, data):
+        properties = dict(data.get('properties', {}))
+        self.property_updates[_(group, subgroup, task)] = properties
+
+    def _load_properties(self, group, subgroup, task):
+        try:
+            data = load_json_file(self._get_task_path(group, subgroup, task))
+        except (DitError, ValueError):
+            # left out of completion
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        properties = data.get('properties')
+        return properties if isinstance(properties, dict) else {}
+
+    def _save_properties(self):
+        from .completion import save_property_cache
+
+        save_property_cache(self.base_path, self.property_updates,
+                            self.index.data, self._load_properties)
+        self.property_updates = {}
+
     # Current Task
 
     def _get_current(self):
@@ -675,7 +1257,10 @@ class Dit:
             'task': self.current_task,
             'halted': self.current_halted
         }
-        save_json_file(self._current_path(), current_data)
+        if self.changes:
+            self._record('state', 'current', self._current_path(),
+                         current_data)
+        self._write_state(self._current_path(), current_data)
         msg.verbose("%s saved: %s%s"
                     % (CURRENT,
                        _(self.current_group,
@@ -692,19 +1277,33 @@ class Dit:
                               current['halted'])
 
     # Previous Task
+    #
+    # The changes made to the stack since it was loaded are made again to the
+    # one saved meanwhile by another dit process, if any.
+
     def _previous_empty(self):
         return len(self.previous_stack) == 0
 
+    def _previous_change(self, change, *selectors):
+        self.previous_changes.append((change,) + selectors)
+        change(self.previous_stack, *selectors)
+
     def _previous_add(self, group, subgroup, task):
-        s = _(group, subgroup, task)
-        self.previous_stack.append(s)
+        self._previous_change(_stack_add, _(group, subgroup, task))
 
     def _previous_remove(self, group, subgroup, task):
-        s = _(group, subgroup, task)
-        self.previous_stack = [i for i in self.previous_stack if i != s]
+        self._previous_change(_stack_remove, _(group, subgroup, task))
 
     def _previous_pop(self):
-        return selector_split(self.previous_stack.pop())
+        s = self.previous_stack[-1]
+        self._previous_change(_stack_pop, s)
+        return selector_split(s)
+
+    def _previous_replace(self, from_selector, to_selector):
+        if from_selector not in self.previous_stack:
+            return False
+        self._previous_change(_stack_replace, from_selector, to_selector)
+        return True
 
     def _previous_peek(self):
         if self._previous_empty():
@@ -712,34 +1311,126 @@ class Dit:
         return selector_split(self.previous_stack[-1])
 
     def _save_previous(self):
-        save_json_file(self._previous_path(), self.previous_stack)
+        if self.changes:
+            self._record('state', 'previous', self._previous_path(),
+                         self.previous_stack)
+        if self.pending is None:
+            self._write_previous()
+        else:
+            self.previous_unsaved = True
         l = len(self.previous_stack)
         msg.verbose("%s saved. It has %d task%s now."
                     % (PREVIOUS, l, "s" if l != 1 else ""))
 
+    def _write_previous(self):
+        from .locking import directory_lock
+
+        fp = self._previous_path()
+        with directory_lock(self.base_path).writing():
+            if file_stamp(fp) != self.previous_stamp:
+                self.previous_stack = load_json_file(fp) or []
+                for change in self.previous_changes:
+                    change[0](self.previous_stack, *change[1:])
+            save_json_file(fp, self.previous_stack)
+            self.previous_stamp = file_stamp(fp)
+            self.previous_changes = []
+
     def _load_previous(self):
-        previous = load_json_file(self._previous_path())
+        fp = self._previous_path()
+        self.previous_stamp = file_stamp(fp)
+        self.previous_changes = []
+        previous = load_json_file(fp)
         if previous is not None:
             self.previous_stack = previous
 
+    # State
+
+    def _load_state(self):
+        self._load_current()
+        self._load_previous()
+        self.index.load(self.base_path)
+
     # ===========================================
     # Export
 
     # these are for internal use
 
-    def _export_t_k(self, g, i, s, j, t, k, force_header=False):
-        if not t:
+    def _setup_export_fields(self, sort_key=None):
+        fields = getattr(self.exporter, 'fields', None)
+        if fields is None:
+            self.export_fields = None
             return
+        fields = parse_fields(fields())
+        if self.export_limit > 0 or sort_key:
+            # the fields needed by `_export_view` and by the sort key
+            filters = self.export_options.get('filters', {})
+            own = [FIELD_STATE] + filter_fields(filters)
+            if sort_key:
+                own += SORT_FIELDS[sort_key]
+            fields = merge_fields(fields, parse_fields(own))
+        self.export_fields = fields
+
+    def _load_export_data(self, group, subgroup, task):
+        fields = self.export_fields
+        if fields is None:
+            converted = getattr(self.exporter, 'DATETIMES', False)
+            return self._load_task_data(group, subgroup, task, converted)
+        if not fields:
+            # only the ids are needed
+            return {}
+
+        task_fp = self._get_task_path(group, subgroup, task)
+        if self.task_cache is None:
+            source = self._read_task_file(task_fp)
+        else:
+            source = self.task_cache.get(task_fp,
+                                         self._read_converted_task_file,
+                                         is_summary_projection(fields))
+        return project(source, fields)
+
+    def _export_done(self):
+        return self.export_limit > 0 and self.export_count >= self.export_limit
+
+    def _export_view(self, data):
+        # mirrors what the exporters skip, so that only listed tasks are
+        # counted and sorted; skipped tasks give `None`
+        if data.get('concluded_at') and not self.export_options.get('concluded'):
+            return None
+        if not data:
+            return data
+        filters = self.export_options.get('filters', {})
+        # projected data is converted already
+        converted = (self.export_fields is not None or
+                     getattr(self.exporter, 'DATETIMES', False))
+        if converted and 'from' not in filters and 'to' not in filters:
+            if not filters:
+                return data
+            # "where" only reads the properties
+            return apply_filters(data, filters) or None
+        # the others cut the logbook, which the exporter still gets whole
+        view = dict(data)
+        view['logbook'] = [dict(log) for log in data.get('logbook', [])]
+        return apply_filters(convert_datetimes(view), filters) or None
+
+    def _export_t_k(self, g, i, s, j, t, k, force_header=False, data=None):
+        if not t or self._export_done():
+            return
+        if data is None:
+            data = self._load_export_data(g[0], s[0], t)
+            if self.export_limit > 0 and self._export_view(data) is None:
+                return
         if force_header:
             if i > 0:
                 self.exporter.group(g[0], i)
             if j > 0:
                 self.exporter.subgroup(g[0], i, s[0], j)
 
-        data = self._load_task_data(g[0], s[0], t)
         self.exporter.task(g[0], i, s[0], j, t, k, data)
+        self.export_count += 1
 
     def _export_s_j(self, g, i, s, j, force_header=False):
+        if self._export_done():
+            return
         if force_header and i > 0:
             self.exporter.group(g[0], i)
 
@@ -751,14 +1442,147 @@ class Dit:
                              t, k)
 
     def _export_g_i(self, g, i):
+        if self._export_done():
+            return
         if i > 0:
             self.exporter.group(g[0], i)
         for j, s in enumerate(g[1]):
             self._export_s_j(g, i,
                              s, j)
 
+    def _iter_tasks(self, group=None, subgroup=None):
+        for i, g in enumerate(self.index):
+            if group is not None and g[0] != group:
+                continue
+            for j, s in enumerate(g[1]):
+                if subgroup is not None and s[0] != subgroup:
+                    continue
+                for k, t in enumerate(s[1]):
+                    if t:
+                        yield (g, i, s, j, t, k)
+
+    def _export_units(self, group, subgroup):
+        # the output for a task may depend on the previous tasks of its group,
+        # e.g. for the headers, so groups are exported as a whole; unless a
+        # subgroup is selected
+        for i, g in enumerate(self.index):
+            if group is not None and g[0] != group:
+                continue
+            if subgroup is None:
+                tasks = [[j, k, s[0], t]
+                         for j, s in enumerate(g[1])
+                         for k, t in enumerate(s[1]) if t]
+                yield ([g[0], None, i], tasks, partial(self._export_g_i, g, i))
+                continue
+            for j, s in enumerate(g[1]):
+                if s[0] == subgroup:
+                    tasks = [[j, k, s[0], t] for k, t in enumerate(s[1]) if t]
+                    yield ([g[0], s[0], i], tasks,
+                           partial(self._export_s_j, g, i, s, j, True))
+                    break
+
+    def _fingerprints(self, group, tasks, previous_unit=None):
+        previous = {}
+        checked_ns = 0
+        if previous_unit:
+            previous = {json.dumps(task[:4]): task[4:]
+                        for task in previous_unit['tasks']}
+            checked_ns = previous_unit['checked_ns']
+        return [task + task_fingerprint(self._get_task_path(group, task[2], task[3]),
+                                        previous.get(json.dumps(task)),
+                                        checked_ns)
+                for task in tasks]
+
     # these are for external use
 
+    def _export_incremental(self, file, options, key, state_fp, group, subgroup):
+        try:
+            state = load_json_file(state_fp)
+        except ValueError:
+            state = None
+        previous_units = {}
+        if state and state.get('version') == STATE_FILE_VERSION and \
+                state.get('key') == key:
+            previous_units = {json.dumps(unit['unit']): unit
+                              for unit in state['units']}
+
+        # live durations are kept marked, so that reused output can be
+        # brought up to date
+        options['mark-live'] = True
+        buffer = io.StringIO()
+        self.exporter.setup(buffer, options)
+        self._setup_export_fields()
+        self.exporter.begin()
+        begin_text = take_text(buffer)
+
+        units = []
+        rendered = 0
+        current = now(inc=0)
+        for unit, tasks, export in self._export_units(group, subgroup):
+            checked_ns = int(time.time() * 10**9)
+            previous_unit = previous_units.get(json.dumps(unit))
+            fingerprints = self._fingerprints(unit[0], tasks, previous_unit)
+            if previous_unit and previous_unit['tasks'] == fingerprints:
+                previous_unit['checked_ns'] = checked_ns
+                units.append(previous_unit)
+                continue
+            export()
+            rendered += 1
+            units.append({
+                'unit': unit,
+                'tasks': fingerprints,
+                'checked_ns': checked_ns,
+                'rendered_at': current.timestamp(),
+                'output': take_text(buffer),
+            })
+
+        self.exporter.end()
+        end_text = take_text(buffer)
+
+        file.write(begin_text)
+        for unit in units:
+            elapsed = current - datetime.fromtimestamp(unit['rendered_at'],
+                                                       current.tzinfo)
+            file.write(render_live(unit['output'], elapsed))
+        file.write(end_text)
+
+        save_json_file(state_fp, {
+            'version': STATE_FILE_VERSION,
+            'key': key,
+            'units': units,
+        })
+        msg.verbose("Exported %d group%s, reused %d."
+                    % (rendered, "s" if rendered != 1 else "",
+                       len(units) - rendered))
+
+    def _export_sorted(self, group, subgroup, sort_key):
+        key = SORT_KEYS[sort_key]
+        tasks = self._iter_tasks(group, subgroup)
+
+        if sort_key in CHEAP_SORT_KEYS:
+            # task files are only read as they are popped
+            heap = [(key(self._get_task_path(g[0], s[0], t)), n, (g, i, s, j, t, k))
+                    for n, (g, i, s, j, t, k) in enumerate(tasks)]
+            heapq.heapify(heap)
+            while heap and not self._export_done():
+                self._export_t_k(*heapq.heappop(heap)[2], force_header=True)
+            return
+
+        def keyed():
+            for n, (g, i, s, j, t, k) in enumerate(tasks):
+                data = self._load_export_data(g[0], s[0], t)
+                view = self._export_view(data)
+                if view is not None:
+                    yield (key(view), n, (g, i, s, j, t, k), data)
+
+        if self.export_limit > 0:
+            selected = heapq.nsmallest(self.export_limit, keyed())
+        else:
+            selected = sorted(keyed())
+
+        for __, __, task_k, data in selected:
+            self._export_t_k(*task_k, force_header=True, data=data)
+
     def _export_all(self):
         for i, g in enumerate(self.index):
             self._export_g_i(g, i)
@@ -919,43 +1743,312 @@ class Dit:
     # ===========================================
     # Hooks
 
-    def _call_hook(self, hook, cmd_name):
+    # Script hooks run first, then the Python hooks (see hooks). What the
+    # command changed is only recorded when some after hook may use it.
+
+    def _load_hooks(self):
+        from .hooks import load_python_hooks, scan_hooks, wants_changes
+
+        names = scan_hooks(self.base_path)
+        if names is self.hook_scan:
+            return
+        self.hook_scan = names
+        if names is None:
+            self.hook_names = frozenset()
+            self.python_hooks = None
+            self.record_changes = False
+            return
+        self.python_hooks = load_python_hooks(self.base_path, names)
+        self.hook_names = names
+        after_scripts = [hook + ext
+                         for hook in ["after", "after_read", "after_write"]
+                         for ext in ["", ASYNC_HOOK_EXT]]
+        self.record_changes = (wants_changes(self.python_hooks) or
+                               any(name in names for name in after_scripts))
+
+    def _call_hook(self, hook, cmd_name, readonly, changes=None, state=None):
+        if not HOOKS_ENABLED:
+            return
+        hook_fp = self._hook_path(hook)
+        script = hook in self.hook_names
+        async_script = hook.startswith("after") and \
+            hook + ASYNC_HOOK_EXT in self.hook_names
+        if not (script or async_script or self.python_hooks):
+            return
+
+        from .hooks import HookEvent, call_python_hooks, event_env
+
+        event = HookEvent(hook, cmd_name, self.base_path, readonly, changes,
+                          state)
+        if script:
+            msg.verbose("Executing hook: %s" % hook)
+            with span("hook %s" % hook, "hook"), \
+                    event_env(event.to_json()) as env:
+                run_subprocess([hook_fp, self.base_path, cmd_name],
+                               check=CHECK_HOOKS, env=env)
+        if async_script:
+            self._call_async_hook(event)
+        if self.python_hooks:
+            call_python_hooks(self.python_hooks, event, CHECK_HOOKS)
+
+    def _call_async_hook(self, event):
+        hook_name = event.hook + ASYNC_HOOK_EXT
+        if CHECK_HOOKS:
+            from .hooks import event_env
+
+            msg.verbose("Executing hook: %s" % hook_name)
+            with span("hook %s" % event.hook, "hook"), \
+                    event_env(event.to_json()) as env:
+                run_subprocess([self._hook_path(hook_name), self.base_path,
+                                event.command], check=True, env=env)
+            return
+        from .spool import enqueue
+
+        msg.verbose("Queued hook: %s" % hook_name)
+        enqueue(self.base_path, event.hook, event.command, event.to_json())
+        self.spooled = True
+
+    def _call_before_hooks(self, cmd_name, readonly):
+        if cmd_name in UNHOOKED_COMMANDS:
+            return
         if HOOKS_ENABLED:
-            hook_fp = self._hook_path(hook)
-            if os.path.isfile(hook_fp):
-                msg.verbose("Executing hook: %s" % hook)
-                try:
-                    run_subprocess([hook_fp, self.base_path, cmd_name],
-                                   check=CHECK_HOOKS)
-                except subprocess.CalledProcessError:
-                    raise SubprocessError(hook_fp)
+            self._load_hooks()
+        self._call_hook("before", cmd_name, readonly)
+        if readonly:
+            self._call_hook("before_read", cmd_name, readonly)
+        else:
+            self._call_hook("before_write", cmd_name, readonly)
+        if HOOKS_ENABLED and self.record_changes:
+            from .hooks import Changes
+
+            self.changes.append(Changes())
+
+    def _call_after_hooks(self, cmd_name, readonly):
+        if cmd_name in UNHOOKED_COMMANDS:
+            return
+        changes = None
+        state = None
+        if HOOKS_ENABLED and self.record_changes:
+            changes = self.changes.pop()
+            state = self._hook_state(changes)
+        if readonly:
+            self._call_hook("after_read", cmd_name, readonly, changes, state)
+        else:
+            self._call_hook("after_write", cmd_name, readonly, changes, state)
+        self._call_hook("after", cmd_name, readonly, changes, state)
+        if self.spooled:
+            from .spool import start_worker
+
+            start_worker(self.base_path)
+            self.spooled = False
+
+    # ===========================================
+    # Fetchers
+    #
+    # Fetching many tasks runs their fetchers in threads, up to `jobs` at
+    # once, and then applies what they fetched in order, like a batch: the
+    # files are written once all are done.
+    #
+    # A streaming fetcher (see fetchers) is preferred to the ".fetcher" of
+    # the same directory. It is started when first needed and kept until the
+    # command is done, so a batch or a shell use the same one.
+
+    def _fetcher_path(self, group, subgroup):
+        # the nearest one
+        paths = [fp for fp in [
+            self._plugin_path(STREAM_FETCHER_FN, group, subgroup),
+            self._plugin_path(FETCHER_FN, group, subgroup),
+        ] if fp]
+        if not paths:
+            return None
+        return max(paths, key=lambda fp: len(os.path.dirname(fp)))
+
+    def _stream_fetcher(self, fetcher_fp):
+        from .fetchers import StreamFetcher
+
+        fetcher = self.stream_fetchers.get(fetcher_fp)
+        if fetcher is not None and fetcher.stopped:
+            fetcher.close()
+            fetcher = None
+        if fetcher is None:
+            msg.verbose("Starting `%s`." % fetcher_fp)
+            fetcher = StreamFetcher(fetcher_fp, self.base_path)
+            self.stream_fetchers[fetcher_fp] = fetcher
+        return fetcher
+
+    def _setup_fetch_cache(self):
+        from .cache import FetchCache
+
+        if self.fetch_cache is None:
+            self.fetch_cache = FetchCache(self.base_path)
+
+    def _close_fetchers(self):
+        for fetcher in self.stream_fetchers.values():
+            fetcher.close()
+        self.stream_fetchers = {}
+        if self.fetch_cache is not None:
+            self.fetch_cache.save()
 
     def _fetch_data_for(self, group, subgroup, task):
-        fetcher_fp = self._plugin_path(FETCHER_FN, group, subgroup)
+        fetcher_fp = self._fetcher_path(group, subgroup)
         if not fetcher_fp:
             raise DitError("Data fetcher script `%s` not found."
                            % FETCHER_FN)
         else:
             msg.verbose("Fetching data with `%s`." % fetcher_fp)
+        self._setup_fetch_cache()
+        return self._run_fetcher(fetcher_fp, group, subgroup, task)
+
+    def _run_fetcher(self, fetcher_fp, group, subgroup, task, output=None):
+        # with `output`, a list, the output of the fetcher is added to it
+        key = _(group, subgroup, task)
+        cached = self.fetch_cache.get(key)
+        if cached and cached[2]:
+            msg.verbose("Fetched data still cached: %s" % key)
+            return cached[0]
+        validator = cached[1] if cached else None
+
+        if os.path.basename(fetcher_fp) == STREAM_FETCHER_FN:
+            fetched = self._call_stream_fetcher(fetcher_fp, group, subgroup,
+                                                task, validator)
+        else:
+            fetched = self._call_fetcher(fetcher_fp, group, subgroup, task,
+                                         validator, output)
+        if fetched is None:
+            msg.verbose("Fetched data not modified: %s" % key)
+            self.fetch_cache.touch(key)
+            return cached[0]
+        (data, validator) = fetched
+        if validator is not None or self.fetch_cache.ttl:
+            self.fetch_cache.put(key, data, validator)
+        elif cached:
+            self.fetch_cache.discard(key)
+        return data
+
+    def _call_stream_fetcher(self, fetcher_fp, group, subgroup, task,
+                             validator):
+        # (data, validator), or `None` when not modified
+        with span("fetcher", "fetcher", task=_(group, subgroup, task),
+                  streaming=True):
+            response = self._stream_fetcher(fetcher_fp).fetch(
+                _(group), _(subgroup), _(task), validator)
+        if validator is not None and response.get('not_modified'):
+            return None
+        data = response.get('data') or {}
+        if not is_valid_task_data(data):
+            raise DitError("Fetched data is invalid: %s"
+                           % _(group, subgroup, task))
+        return (data, response.get('validator'))
+
+    def _call_fetcher(self, fetcher_fp, group, subgroup, task, validator,
+                      output):
+        # (data, validator), or `None` when not modified
+        import subprocess
+
+        from .fetchers import fetch_timeout
 
         fetch_fp = self._make_task_path(group, subgroup, task) + ".json"
 
-        try:
-            run_subprocess([
-                fetcher_fp, self.base_path, _(group), _(subgroup), _(task)
-            ], check=True)
-        except subprocess.CalledProcessError:
+        kwargs = {}
+        if output is not None:
+            kwargs = {'stdout': subprocess.PIPE, 'universal_newlines': True}
+        if validator is not None:
+            kwargs['env'] = dict(os.environ, DIT_FETCH_VALIDATOR=validator)
+        timeout = fetch_timeout()
+        with span("fetcher", "fetcher", task=_(group, subgroup, task)):
+            try:
+                result = run_subprocess([
+                    fetcher_fp, self.base_path, _(group), _(subgroup), _(task)
+                ], timeout=timeout, **kwargs)
+            except subprocess.TimeoutExpired:
+                raise DitError("Data fetcher `%s` timed out after %g seconds."
+                               % (fetcher_fp, timeout))
+        if output is not None:
+            output.append(result.stdout)
+        if result.returncode != 0:
             raise SubprocessError(fetcher_fp)
 
         if not os.path.isfile(fetch_fp):
+            if validator is not None:
+                return None
             raise DitError("`%s` not found: it seems no data was fetched."
                            % fetch_fp)
 
         data = load_json_file(fetch_fp)
+        validator = data.pop('validator', None) \
+            if isinstance(data, dict) else None
         if not is_valid_task_data(data):
             raise DitError("Fetched data is invalid: %s" % fetch_fp)
         os.remove(fetch_fp)
-        return data
+        return (data, validator)
+
+    def _try_fetcher(self, fetch):
+        # (data, error, output), run in a thread
+        output = []
+        try:
+            return (self._run_fetcher(*fetch, output=output), None,
+                    ''.join(output))
+        except COMMAND_ERRORS as err:
+            return (None, error_message(err), ''.join(output))
+
+    def _fetch_many(self, group, subgroup, jobs):
+        from concurrent.futures import ThreadPoolExecutor
+
+        fetches = []
+        for (g, i, s, j, t, k) in self._iter_tasks(group, subgroup):
+            fetcher_fp = self._fetcher_path(g[0], s[0])
+            if fetcher_fp:
+                fetches.append((fetcher_fp, g[0], s[0], t))
+                if os.path.basename(fetcher_fp) == STREAM_FETCHER_FN:
+                    # before the threads, which share it
+                    self._stream_fetcher(fetcher_fp)
+        if not fetches:
+            raise DitError("No task with a data fetcher script `%s`."
+                           % FETCHER_FN)
+        self._setup_fetch_cache()
+        jobs = min(jobs, len(fetches))
+        msg.verbose("Fetching data for %d tasks, %d at a time."
+                    % (len(fetches), jobs))
+
+        with span("fetchers", "fetcher", tasks=len(fetches), jobs=jobs):
+            with ThreadPoolExecutor(jobs) as pool:
+                results = list(pool.map(self._try_fetcher, fetches))
+
+        failed = 0
+        batch = self.pending is not None
+        if not batch:
+            self.pending = {}
+            self.index.deferred = True
+        try:
+            for (__, group, subgroup, task), (data, error, output) in \
+                    zip(fetches, results):
+                selector = _(group, subgroup, task)
+                sys.stdout.write(output)
+                try:
+                    if error:
+                        raise DitError(error)
+                    if data:
+                        initial_data = self._load_task_data(group, subgroup,
+                                                            task)
+                        self._save_task(group, subgroup, task,
+                                        data_update(initial_data, data))
+                        msg.normal("Fetched data for: %s" % selector)
+                    else:
+                        msg.normal("Nothing fetched for: %s" % selector)
+                except COMMAND_ERRORS as err:
+                    msg.error("%s: %s" % (selector, error_message(err)))
+                    failed += 1
+        finally:
+            if not batch:
+                self._write_pending()
+                self.pending = None
+                self.index.deferred = False
+
+        msg.normal("Fetched data for %d of %d tasks."
+                   % (len(fetches) - failed, len(fetches)))
+        if failed:
+            raise DitError("%d fetch%s failed."
+                           % (failed, "es" if failed != 1 else ""))
 
     # ===========================================
     # Commands
@@ -983,7 +2076,7 @@ class Dit:
         maybe_raise_unrecognized_argument(argv)
         self._raise_task_exists(group, subgroup, task)
 
-        data = NEW_TASK_DATA
+        data = deepcopy(NEW_TASK_DATA)
         if fetch:
             fetched_data = self._fetch_data_for(group, subgroup, task)
             data = data_update(data, fetched_data)
@@ -1182,7 +2275,7 @@ class Dit:
             elif opt in ["--where", "-w"]:
                 filters["where"] = [argv.pop(0), re.compile(argv.pop(0))]
             elif opt in ["--limit", "-l", "-n"]:
-                limit = int(argv.pop(0))
+                limit = pop_int(argv, opt)
                 if limit < 1:
                     limit = 1
             else:
@@ -1192,8 +2285,12 @@ class Dit:
         if filters:
             options['filters'] = filters
 
+        if self.mark_live:
+            options['mark-live'] = True
+
         self.exporter = load_plugin('dit_exporter')
         self.exporter.setup(sys.stdout, options)
+        self._setup_export_fields()
         self.exporter.begin()
 
         (group, subgroup, task) = self._get_current_task()
@@ -1211,12 +2308,18 @@ class Dit:
     def list(self, argv):
         self.export(argv, listing=True)
 
-    @command("o", LIST_OPTIONS + ["--output", "--format"], SELECT_FORWARD, True)
+    @command("o", LIST_OPTIONS + ["--output", "--format", "--incremental", "--state-file"],
+             SELECT_FORWARD, True)
     def export(self, argv, listing=False):
         all = False
         output_file = None
         output_format = None
 
+        limit = 0
+        sort_key = None
+        incremental = False
+        state_file = None
+
         options = {}
         filters = {}
 
@@ -1244,10 +2347,20 @@ class Dit:
                 options['concluded'] = True
             elif opt in ["--compact", "-z"]:
                 options['compact-header'] = True
+            elif opt in ["--limit", "-l"]:
+                limit = pop_positive_int(argv, opt)
+            elif opt in ["--sort"]:
+                sort_key = argv.pop(0)
+                if sort_key not in SORT_KEYS:
+                    raise ArgumentError("No such sort key: %s" % sort_key)
             elif opt in ["--output", "-o"] and not listing:
                 output_file = argv.pop(0)
             elif opt in ["--format", "-f"] and not listing:
                 output_format = argv.pop(0)
+            elif opt in ["--incremental"] and not listing:
+                incremental = True
+            elif opt in ["--state-file"] and not listing:
+                state_file = argv.pop(0)
             else:
                 raise ArgumentError("No such option: %s" % opt)
         if len(argv) > 0:
@@ -1258,9 +2371,31 @@ class Dit:
         if task:
             options['concluded'] = True
 
+        if incremental:
+            if task or limit or sort_key or options.get('sum'):
+                raise ArgumentError("Option --incremental cannot be used for a "
+                                    "single task nor with --limit, --sort or "
+                                    "--sum.")
+            if not state_file:
+                if output_file in [None, "stdout"]:
+                    raise ArgumentError("Option --incremental requires "
+                                        "--state-file when exporting to stdout.")
+                state_file = output_file + STATE_FILE_EXT
+
         if filters:
             options['filters'] = filters
 
+        if sort_key:
+            # a sorted export mixes groups, so each task carries its full name
+            options['compact-header'] = True
+
+        if self.mark_live:
+            options['mark-live'] = True
+
+        self.export_options = options
+        self.export_limit = limit
+        self.export_count = 0
+
         if output_file in [None, "stdout"]:
             exporter_stdout = sys.stdout
         else:
@@ -1272,14 +2407,31 @@ class Dit:
         output_format = output_format or 'dit'
 
         self.exporter = load_plugin("%s_exporter" % output_format)
+
+        if incremental:
+            if all:
+                group, subgroup = None, None
+            key = export_key(output_format, options, group, subgroup)
+            self._export_incremental(exporter_stdout, options, key, state_file,
+                                     group, subgroup)
+            if output_file not in [None, "stdout"]:
+                exporter_stdout.close()
+            return
+
         self.exporter.setup(exporter_stdout, options)
+        self._setup_export_fields(sort_key)
         self.exporter.begin()
 
         if all:
-            self._export_all()
+            if sort_key:
+                self._export_sorted(None, None, sort_key)
+            else:
+                self._export_all()
         elif task:
             if not self._export_task(group, subgroup, task):
                 raise DitError('Task not found in index.')
+        elif sort_key:
+            self._export_sorted(group, subgroup, sort_key)
         elif subgroup is not None:
             self._export_subgroup(group, subgroup)
         elif group is not None:
@@ -1292,8 +2444,33 @@ class Dit:
         if output_file not in [None, "stdout"]:
             exporter_stdout.close()
 
-    @command("f", [], SELECT_BACKWARD)
+    @command("f", ["--all", "--group", "--jobs"], SELECT_BACKWARD)
     def fetch(self, argv):
+        all = False
+        gname = None
+        jobs = DEFAULT_FETCH_JOBS
+        while len(argv) > 0 and argv[0].startswith("-"):
+            opt = argv.pop(0)
+            if opt in ["--all", "-a"]:
+                all = True
+            elif opt in ["--group", "-g"]:
+                gname = argv.pop(0)
+            elif opt in ["--jobs", "-j"]:
+                jobs = pop_positive_int(argv, opt)
+            else:
+                raise ArgumentError("No such option: %s" % opt)
+
+        if all or gname is not None:
+            group = subgroup = None
+            if gname is not None:
+                (group, subgroup, task) = self._gname_parser(gname)
+                if task:
+                    raise ArgumentError("Option --group takes a <gname>.")
+            maybe_raise_unrecognized_argument(argv)
+            msg_selected(group, subgroup, None)
+            self._fetch_many(group, subgroup, jobs)
+            return
+
         (group, subgroup, task) = self._backward_parser(argv)
         maybe_raise_unrecognized_argument(argv)
 
@@ -1329,7 +2506,8 @@ class Dit:
         data = self._load_task_data(from_group, from_subgroup, from_task)
         self._create_task(to_group, to_subgroup, to_task, data)
 
-        os.remove(from_fp)
+        self._record_change(from_group, from_subgroup, from_task, from_fp, None)
+        self._remove_file(from_fp)
         msg.normal("Task %s moved to %s" % (from_selector, to_selector))
 
         # update CURRENT
@@ -1338,11 +2516,8 @@ class Dit:
             self._save_current()
 
         # update PREVIOUS
-        for i in range(0, len(self.previous_stack)):
-            if self.previous_stack[i] == from_selector:
-                self.previous_stack[i] = to_selector
-                self._save_previous()
-                break
+        if self._previous_replace(from_selector, to_selector):
+            self._save_previous()
 
         # clean INDEX
         self.index.remove(from_group, from_subgroup, from_task)
@@ -1423,22 +2598,330 @@ class Dit:
         self.index.rebuild()
         self.index.save()
 
+        # the task files may have been modified too
+        from .completion import forget_property_cache
+        forget_property_cache(self.base_path)
+
+    @command(None, ["--stop-on-error", "--command-hooks"])
+    def batch(self, argv):
+        stop_on_error = False
+        command_hooks = False
+        while len(argv) > 0 and argv[0].startswith("-") and argv[0] != "-":
+            opt = argv.pop(0)
+            if opt in ["--stop-on-error"]:
+                stop_on_error = True
+            elif opt in ["--command-hooks"]:
+                command_hooks = True
+            else:
+                raise ArgumentError("No such option: %s" % opt)
+        batch_fp = argv.pop(0) if len(argv) > 0 else "-"
+        maybe_raise_unrecognized_argument(argv)
+
+        if batch_fp == "-":
+            lines = sys.stdin.read().splitlines()
+        else:
+            try:
+                with open(batch_fp, 'r') as f:
+                    lines = f.read().splitlines()
+            except OSError:
+                raise DitError("No such batch file: %s" % batch_fp)
+
+        failed = 0
+        self.pending = {}
+        self.index.deferred = True
+        try:
+            for number, line in enumerate(lines, 1):
+                try:
+                    self._batch_command(line, command_hooks)
+                except COMMAND_ERRORS as err:
+                    msg.error("Line %d: %s" % (number, error_message(err)))
+                    failed += 1
+                    if stop_on_error:
+                        break
+        finally:
+            self._write_pending()
+            self.pending = None
+            self.index.deferred = False
+
+        if failed:
+            raise DitError("%d command%s failed."
+                           % (failed, "s" if failed != 1 else ""))
+
+    def _parse_command_line(self, line, context):
+        # for the commands of a batch or of the shell
+        import shlex
+
+        try:
+            argv = shlex.split(line, comments=True)
+        except ValueError as err:
+            raise ArgumentError("Cannot parse the command: %s" % err)
+        if len(argv) == 0:
+            return (None, None, argv)
+
+        cmd = argv.pop(0)
+        if cmd not in COMMAND_INFO:
+            raise ArgumentError("No such command: %s" % cmd)
+        cmd_name = COMMAND_INFO[cmd]['name']
+        if cmd_name in ["batch", "serve", "shell"]:
+            raise ArgumentError("Not available in %s: %s" % (context, cmd))
+        return (cmd_name, COMMAND_INFO[cmd]["readonly"], argv)
+
+    def _batch_command(self, line, command_hooks):
+        (cmd_name, readonly_cmd, argv) = self._parse_command_line(line,
+                                                                  "a batch")
+        if not cmd_name:
+            return
+
+        # these work on the files themselves
+        if readonly_cmd or cmd_name == "rebuild_index":
+            self._write_pending()
+
+        if not command_hooks:
+            with span(cmd_name, "command", line=line):
+                getattr(self, cmd_name)(argv)
+            return
+
+        depth = len(self.changes)
+        try:
+            self._call_before_hooks(cmd_name, readonly_cmd)
+            with span(cmd_name, "command", line=line):
+                getattr(self, cmd_name)(argv)
+            self._write_pending()
+            self._call_after_hooks(cmd_name, readonly_cmd)
+        finally:
+            # those of a failed command are dropped
+            del self.changes[depth:]
+
+    @command(None, [], None, True)
+    def plugins(self, argv):
+        from .hooks import HOOKS_ENTRY_POINTS
+        from .registry import (
+            EXPORTERS_ENTRY_POINTS,
+            entry_points,
+            load_entry_point,
+        )
+
+        maybe_raise_unrecognized_argument(argv)
+
+        exporters = [(name, find_plugin(name + EXPORTER_SUFFIX))
+                     for name in exporter_formats()]
+        hooks = sorted(entry_points(HOOKS_ENTRY_POINTS).items())
+        for group, plugins in [(EXPORTERS_ENTRY_POINTS, exporters),
+                               (HOOKS_ENTRY_POINTS, hooks)]:
+            msg.normal("%s:" % group)
+            if not plugins:
+                msg.normal("  (none)")
+            for name, value in plugins:
+                start = time.perf_counter()
+                try:
+                    load_entry_point(value)
+                except Exception as err:
+                    msg.normal("  %-12s %-32s failed: %s" % (name, value, err))
+                    continue
+                msg.normal("  %-12s %-32s %7.2fms"
+                           % (name, value,
+                              (time.perf_counter() - start) * 1000))
+
+    @command(None, [], None, True)
+    def shell(self, argv):
+        maybe_raise_unrecognized_argument(argv)
+        from .completion import ShellCompleter
+
+        completer = ShellCompleter(self, COMMAND_INFO)
+        try:
+            import readline
+            readline.set_completer(completer.complete)
+            readline.set_completer_delims(" \t\n\"'")
+            readline.parse_and_bind("tab: complete")
+        except ImportError:
+            # no line editing, nor completion
+            pass
+
+        self.state_stamps = self._state_stamps()
+        while True:
+            try:
+                line = input(SHELL_PROMPT if sys.stdin.isatty() else "")
+            except EOFError:
+                msg.normal()
+                break
+            except KeyboardInterrupt:
+                msg.normal()
+                continue
+            if line.strip() in ["exit", "quit"]:
+                break
+
+            try:
+                self._refresh_state()
+                self._shell_command(line)
+            except COMMAND_ERRORS as err:
+                msg.error(error_message(err))
+            except KeyboardInterrupt:
+                msg.normal()
+            finally:
+                # what the command wrote is already loaded
+                self.state_stamps = self._state_stamps()
+                completer.invalidate()
+
+    def _shell_command(self, line):
+        (cmd_name, readonly_cmd, argv) = self._parse_command_line(line,
+                                                                  "the shell")
+        if not cmd_name:
+            return
+
+        # those of a previous command that failed
+        self.changes = []
+        self.plugin_paths = {}
+        self._call_before_hooks(cmd_name, readonly_cmd)
+        with span(cmd_name, "command", line=line):
+            self._run(cmd_name, argv, readonly_cmd)
+        if self.task_cache:
+            self.task_cache.save()
+        self._call_after_hooks(cmd_name, readonly_cmd)
+
+    # The state is only loaded again when one of its files changes, which is
+    # told by their mtime and size.
+
+    def _state_stamps(self):
+        return [file_stamp(self._current_path()),
+                file_stamp(self._previous_path()),
+                file_stamp(self.index.fp)]
+
+    def _refresh_state(self):
+        stamps = self._state_stamps()
+        if stamps == self.state_stamps:
+            return False
+        msg.verbose("Reloading the state.")
+        self._clear_current()
+        self.previous_stack = []
+        self.index = Index()
+        self._load_state()
+        self.state_stamps = stamps
+        return True
+
+    @command(None, [], None, True)
+    def hooks(self, argv):
+        from . import spool
+
+        action = argv.pop(0) if len(argv) > 0 else "status"
+        maybe_raise_unrecognized_argument(argv)
+
+        if action == "status":
+            pid = spool.worker_pid(self.base_path)
+            msg.normal("Worker: %s" % ("running (pid %d)" % pid if pid
+                                       else "not running"))
+            for hook, pending, failed in spool.status(self.base_path):
+                msg.normal("%s: %d pending, %d failed"
+                           % (hook + ASYNC_HOOK_EXT, pending, failed))
+        elif action == "drain":
+            spool.drain(self.base_path, blocking=True)
+        elif action == "retry":
+            count = spool.retry(self.base_path)
+            msg.normal("Queued again: %d event%s"
+                       % (count, "s" if count != 1 else ""))
+            if count:
+                spool.start_worker(self.base_path)
+        else:
+            raise ArgumentError("No such action: %s" % action)
+
+    @command(None, ["--stop"], None, True)
+    def serve(self, argv):
+        from .server import serve, stop
+
+        stopping = False
+        while len(argv) > 0 and argv[0].startswith("-"):
+            opt = argv.pop(0)
+            if opt in ["--stop"]:
+                stopping = True
+            else:
+                raise ArgumentError("No such option: %s" % opt)
+        maybe_raise_unrecognized_argument(argv)
+
+        if stopping:
+            stop(self.base_path)
+        else:
+            serve(self.base_path)
+
+    # ===========================================
+    # Result cache
+
+    def _result_key(self, cmd_name, argv, verbose):
+        if cmd_name in ["serve", "shell"]:
+            return None
+        for i, arg in enumerate(argv):
+            if arg in ["--output", "-o"]:
+                return None
+            if arg in ["--from", "--to"] and i + 1 < len(argv) and \
+                    is_relative_to_now(argv[i + 1]):
+                return None
+        return [cmd_name, verbose] + argv
+
+    def _run_cached(self, cmd_name, argv, verbose):
+        key = self._result_key(cmd_name, argv, verbose)
+        if key is None or sys.stdout.isatty():
+            self._load_state()
+            self._run_locked(cmd_name, argv, True)
+            return
+
+        from .cache import Recorder, ResultCache
+
+        results = ResultCache(self.base_path)
+        if results.replay(key, sys.stdout):
+            return
+
+        self._load_state()
+
+        rendered_at = now(inc=0)
+        recorder = Recorder(sys.stdout)
+        sys.stdout = recorder
+        self.mark_live = True
+        try:
+            self._run_locked(cmd_name, argv, True)
+        finally:
+            sys.stdout = recorder.file
+            self.mark_live = False
+        results.save(key, recorder.getvalue(), rendered_at)
+
     # ===========================================
     # Main
 
+    def _run(self, cmd_name, argv, readonly_cmd):
+        from .cache import bump_generation
+
+        try:
+            self._run_locked(cmd_name, argv, readonly_cmd)
+        finally:
+            if not readonly_cmd:
+                bump_generation(self.base_path)
+                self._save_properties()
+
     def interpret(self, argv):
         global HOOKS_ENABLED
         global CHECK_HOOKS
+        global CACHE_RESULTS
+        global TASK_CACHE_ENABLED
         directory = None
+        verbose = False
+        profiler = None
+        profile_fp = None
 
         while len(argv) > 0 and argv[0].startswith("-"):
             opt = argv.pop(0)
             if opt in ["--verbose", "-v"]:
                 msg.turn_verbose_on()
+                verbose = True
+            elif opt in ["--profile"]:
+                profiler = profiler or start_profiler()
+            elif opt in ["--profile-json"]:
+                profiler = profiler or start_profiler()
+                profile_fp = argv.pop(0)
             elif opt in ["--no-hooks"]:
                 HOOKS_ENABLED = False
             elif opt in ["--check-hooks"]:
                 CHECK_HOOKS = True
+            elif opt in ["--cache-results"]:
+                CACHE_RESULTS = True
+            elif opt in ["--no-cache"]:
+                TASK_CACHE_ENABLED = False
             elif opt in ["--directory", "-d"]:
                 directory = argv.pop(0)
             elif opt in ["--help", "-h"]:
@@ -1447,6 +2930,20 @@ class Dit:
             else:
                 raise ArgumentError("No such option: %s" % opt)
 
+        if profiler is None:
+            self._interpret_command(directory, argv, verbose)
+            return
+        try:
+            self._interpret_command(directory, argv, verbose)
+        finally:
+            profiler.stop()
+            if profile_fp:
+                profiler.save(profile_fp)
+            else:
+                sys.stdout.flush()
+                sys.stderr.write(profiler.summary())
+
+    def _interpret_command(self, directory, argv, verbose):
         self._setup_base_path(directory)
 
         if len(argv) == 0:
@@ -1459,40 +2956,62 @@ class Dit:
         readonly_cmd = COMMAND_INFO[cmd]["readonly"]
         cmd_name = COMMAND_INFO[cmd]['name']
 
-        self._call_hook("before", cmd_name)
-        if readonly_cmd:
-            self._call_hook("before_read", cmd_name)
-        else:
-            self._call_hook("before_write", cmd_name)
+        from .cache import TaskCache
 
-        self._load_current()
-        self._load_previous()
-        self.index.load(self.base_path)
-        getattr(self, cmd_name)(argv)
+        self._call_before_hooks(cmd_name, readonly_cmd)
 
-        if readonly_cmd:
-            self._call_hook("after_read", cmd_name)
-        else:
-            self._call_hook("after_write", cmd_name)
-        self._call_hook("after", cmd_name)
+        if TASK_CACHE_ENABLED:
+            self.task_cache = TaskCache(self.base_path)
+
+        try:
+            if readonly_cmd and CACHE_RESULTS:
+                self._run_cached(cmd_name, argv, verbose)
+            else:
+                self._load_state()
+                self._run(cmd_name, argv, readonly_cmd)
+        finally:
+            self._close_fetchers()
+
+        if self.task_cache:
+            self.task_cache.save()
+
+        self._call_after_hooks(cmd_name, readonly_cmd)
 
 # ===========================================
 # Entry Point
 
 
-def interpret(argv):
-    try:
-        dit = Dit()
-        dit.interpret(argv)
-    except DitError as err:
-        msg.error(err)
-    except SubprocessError as err:
-        msg.error("`%s` returned with non-zero code, aborting." % err)
-    except IndexError as err:
+# errors reported for a command, which is then aborted
+COMMAND_ERRORS = (
+    DitError,
+    SubprocessError,
+    IndexError,
+    json.decoder.JSONDecodeError,
+    re.error,
+)
+
+
+def error_message(err):
+    if isinstance(err, SubprocessError):
+        return "`%s` returned with non-zero code, aborting." % err
+    elif isinstance(err, IndexError):
         # this was probably caused by a pop on an empty argument list
-        msg.error("Missing argument.")
-    except json.decoder.JSONDecodeError:
-        msg.error("Invalid JSON.")
-    except re.error as err:
+        return "Missing argument."
+    elif isinstance(err, json.decoder.JSONDecodeError):
+        return "Invalid JSON."
+    elif isinstance(err, re.error):
         # this was probably caused by a bad regex in the --where filter
-        msg.error("Bad regular expression: %s" % err)
+        return "Bad regular expression: %s" % err
+    return str(err)
+
+
+def interpret(argv):
+    tracing.start(' '.join(['dit'] + argv))
+    try:
+        with span("dit", "command", argv=list(argv)):
+            dit = Dit()
+            dit.interpret(argv)
+    except COMMAND_ERRORS as err:
+        msg.error(error_message(err))
+    finally:
+        tracing.stop()
@@ -2,28 +2,36 @@
 
 import io
 import sys
-import subprocess
 from datetime import timedelta
 
 from .dit import names_to_string
-from .utils import (dt2str, td2str,
+from .common import (FIELD_DATES, FIELD_LOGBOOK, FIELD_NOTES,
+                     FIELD_PROPERTIES, FIELD_STATE, FIELD_TITLE,
+                     FIELD_TOTALS)
+from .utils import (dt2str, td2str, live_td2str,
                     time_spent_on,
                     convert_datetimes,
+                    filter_fields,
                     apply_filters)
 
+DATETIMES = True
+
 _file = None
 _isatty = False
 _pager = None
-_options = {
+_DEFAULT_OPTIONS = {
     'verbose': False,
     'id-only': False,
     'concluded': False,
     'statussing': False,
     'compact-header': False,
     'sum': False,
+    'mark-live': False,
     'filters': {}
 }
+_options = dict(_DEFAULT_OPTIONS)
 _overall_time_spent = timedelta()
+_overall_live = False
 
 _group_string = None
 _subgroup_string = None
@@ -67,6 +75,15 @@ def _cf(string):
         return '\033[0;34m' + string + '\033[0m'
     return string
 
+# ===========================================
+# Time spent
+
+
+def _td2str(td, live):
+    if live and _options['mark-live']:
+        return live_td2str(td)
+    return td2str(td)
+
 # ===========================================
 # Write helpers
 
@@ -83,18 +100,51 @@ def _write_p(name, string=''):
 
 
 def setup(file, options):
+    # once per command, and a process may run several, e.g. a batch or a shell
     global _file
     global _options
     global _isatty
+    global _overall_time_spent, _overall_live
+    global _group_string, _subgroup_string
     _file = file
     _isatty = file.isatty()
-    _options.update(options)
+    _options = dict(_DEFAULT_OPTIONS, **options)
+    _overall_time_spent = timedelta()
+    _overall_live = False
+    _group_string = None
+    _subgroup_string = None
+
+
+def fields():
+    verbose = _options['verbose']
+    statussing = _options['statussing']
+
+    needed = filter_fields(_options['filters'])
+    if not _options['concluded']:
+        needed.append(FIELD_STATE)
+    if _options['id-only']:
+        return needed
+
+    needed += [FIELD_TITLE, FIELD_TOTALS]
+    if verbose or not statussing:
+        needed += [FIELD_PROPERTIES, FIELD_NOTES]
+    if verbose:
+        needed.append(FIELD_DATES)
+
+    if statussing:
+        needed.append(FIELD_LOGBOOK + ':1')
+    elif verbose:
+        needed.append(FIELD_LOGBOOK)
+    else:
+        needed.append(FIELD_LOGBOOK + ':3')
+    return needed
 
 
 def begin():
     if _isatty:
         global _pager
         global _file
+        import subprocess
         _pager = subprocess.Popen(['less', '-F', '-R', '-S', '-X', '-K'],
                                   stdin=subprocess.PIPE, stdout=sys.stdout)
         _file = io.TextIOWrapper(_pager.stdin, 'UTF-8')
@@ -103,7 +153,7 @@ def begin():
 def end():
     if _options['sum']:
         _write('\n%s %s' % (_cf("Overall time spent:"),
-                            td2str(_overall_time_spent)))
+                            _td2str(_overall_time_spent, _overall_live)))
     if _isatty:
         _file.close()
         _pager.wait()
@@ -111,8 +161,9 @@ def end():
 
 def group(group, group_id):
     if not _options.get('compact-header'):
-        global _group_string
+        global _group_string, _subgroup_string
         _group_string = _ca('[%s] %s' % (group_id, group))
+        _subgroup_string = None
 
 
 def subgroup(group, group_id, subgroup, subgroup_id):
@@ -133,9 +184,11 @@ def task(group, group_id, subgroup, subgroup_id, task, task_id, data):
         return
 
     # data preprocessor
-    data = apply_filters(convert_datetimes(data), filters)
-    if not data:
-        return
+    data = convert_datetimes(data)
+    if filters:
+        data = apply_filters(data, filters)
+        if not data:
+            return
 
     # write
     if id_only:
@@ -186,9 +239,11 @@ def task(group, group_id, subgroup, subgroup_id, task, task_id, data):
         _write_p('Concluded at', dt2str(concluded_at))
 
     if logbook:
-        global _overall_time_spent
-        time_spent = time_spent_on(logbook)
+        global _overall_time_spent, _overall_live
+        time_spent = data.get('time_spent') or time_spent_on(logbook)
+        live = not logbook[-1]['out']
         _overall_time_spent += time_spent
+        _overall_live = _overall_live or live
 
         if statussing and not verbose:
             log = logbook[-1]
@@ -198,7 +253,7 @@ def task(group, group_id, subgroup, subgroup_id, task, task_id, data):
                 return _ce(description) + ' ' + value + '. '
 
             if time_spent:
-                string += "%s %s. " % (_ce('Spent'), td2str(time_spent))
+                string += "%s %s. " % (_ce('Spent'), _td2str(time_spent, live))
             if log['out']:
                 string += "%s %s." % (_ce('Clocked out at'), dt2str(log['out']))
             else:
@@ -206,7 +261,7 @@ def task(group, group_id, subgroup, subgroup_id, task, task_id, data):
             _write(string)
 
         else:
-            _write_p('Time spent', td2str(time_spent))
+            _write_p('Time spent', _td2str(time_spent, live))
             if statussing:
                 _write(_ce('  Last logbook entry:'))
                 i = -1
@@ -20,3 +20,23 @@ class SubprocessError(Exception):
 def maybe_raise_unrecognized_argument(argv):
     if len(argv) > 0:
         raise ArgumentError("Unrecognized argument: %s" % argv[0])
+
+
+def pop_int(argv, opt):
+    # the value of an option such as "--limit N"
+    if len(argv) == 0:
+        raise ArgumentError("Missing value for %s." % opt)
+    value = argv.pop(0)
+    try:
+        return int(value)
+    except ValueError:
+        raise ArgumentError("Option %s takes an integer, not: %s"
+                            % (opt, value))
+
+
+def pop_positive_int(argv, opt):
+    number = pop_int(argv, opt)
+    if number < 1:
+        raise ArgumentError("Option %s takes a positive integer, not: %d"
+                            % (opt, number))
+    return number
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import time
+
+from .exceptions import DitError
+
+# ===========================================
+# Constants
+
+FETCH_TIMEOUT_ENV = 'DIT_FETCH_TIMEOUT'
+DEFAULT_FETCH_TIMEOUT = 60
+
+# seconds given to a streaming fetcher to exit once its stdin is closed
+CLOSE_TIMEOUT = 5
+
+
+def fetch_timeout():
+    try:
+        return max(0.0, float(os.environ.get(FETCH_TIMEOUT_ENV) or
+                              DEFAULT_FETCH_TIMEOUT))
+    except ValueError:
+        return DEFAULT_FETCH_TIMEOUT
+
+# ===========================================
+# Streaming Fetchers
+#
+# A streaming fetcher is started once, as ".fetcher.stream dit-directory",
+# and then fetches any number of tasks while dit runs, e.g. for a batch, a
+# shell or "fetch --all". Each request is a line of JSON on its stdin:
+#
+#     {"id": 1, "group": "g", "subgroup": "s", "task": "t"}
+#
+# and each response a line of JSON on its stdout, with the same id and either
+# the fetched data or an error message:
+#
+#     {"id": 1, "data": {"title": "..."}}
+#     {"id": 1, "error": "..."}
+#
+# A request may also give the validator that came with the data fetched last
+# time (see FetchCache in cache), to which the fetcher may answer that the
+# data was not modified, and a response may give the validator of its data:
+#
+#     {"id": 2, "group": "g", "subgroup": "s", "task": "t", "validator": "v1"}
+#     {"id": 2, "not_modified": true}
+#     {"id": 2, "data": {"title": "..."}, "validator": "v2"}
+#
+# Requests may be sent before the previous ones are answered, and answered in
+# any order. The fetcher should exit at the end of its stdin, and write
+# anything else than its responses to stderr. One that does not answer a
+# request within DIT_FETCH_TIMEOUT seconds is killed, and started again for
+# the next one.
+
+
+class StreamFetcher:
+
+    def __init__(self, fetcher_fp, base_path):
+        import subprocess
+
+        self.fetcher_fp = fetcher_fp
+        self.timeout = fetch_timeout()
+        self.process = subprocess.Popen(
+            [fetcher_fp, base_path], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, universal_newlines=True, bufsize=1)
+        self.last_id = 0
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.stopped = False
+        self.answered = threading.Condition()
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            try:
+                response = json.loads(line)
+                request_id = response['id']
+            except (ValueError, TypeError, KeyError):
+                continue
+            with self.answered:
+                self.responses[request_id] = response
+                self.answered.notify_all()
+        with self.answered:
+            self.stopped = True
+            self.answered.notify_all()
+
+    def _send(self, request):
+        with self.lock:
+            self.last_id += 1
+            request['id'] = self.last_id
+            try:
+                self.process.stdin.write(json.dumps(request) + '\n')
+                self.process.stdin.flush()
+            except OSError:
+                raise DitError("Data fetcher `%s` stopped." % self.fetcher_fp)
+            return self.last_id
+
+    def fetch(self, group, subgroup, task, validator=None):
+        # the response
+        request = {
+            'group': group,
+            'subgroup': subgroup,
+            'task': task,
+        }
+        if validator is not None:
+            request['validator'] = validator
+        request_id = self._send(request)
+        deadline = time.monotonic() + self.timeout
+        with self.answered:
+            while request_id not in self.responses and not self.stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.answered.wait(remaining)
+            response = self.responses.pop(request_id, None)
+            timed_out = response is None and not self.stopped
+        if timed_out:
+            self.process.kill()
+            raise DitError("Data fetcher `%s` timed out after %g seconds."
+                           % (self.fetcher_fp, self.timeout))
+        if response is None:
+            raise DitError("Data fetcher `%s` stopped." % self.fetcher_fp)
+        if response.get('error'):
+            raise DitError("Data fetcher `%s` failed: %s"
+                           % (self.fetcher_fp, response['error']))
+        return response
+
+    def close(self):
+        import subprocess
+
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(CLOSE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.reader.join()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from contextlib import contextmanager
+from functools import partial
+
+from . import messages as msg
+
+from .common import HOOKS_DIR
+from .exceptions import DitError
+from .tracing import span
+
+# ===========================================
+# Constants
+
+PYTHON_HOOKS_FN = 'hooks.py'
+HOOKS_ENTRY_POINTS = 'dit.hooks'
+HOOK_EVENT_ENV = 'DIT_HOOK_EVENT'
+
+# ===========================================
+# Events
+#
+# Every hook gets a `HookEvent`: script hooks as JSON in a temporary file
+# given by DIT_HOOK_EVENT, so that they keep the stdin of dit, e.g. to prompt
+# the user, and
+# Python hooks, which are functions named after the hook ("before",
+# "after_write", etc.), as it is. These are called in-process and defined in
+# the module ".hooks/hooks.py" of the dit directory, or in those given by the
+# entry points "dit.hooks" of the installed distributions.
+#
+# The tasks of an event are the selectors of the tasks that the command
+# created, modified or removed, and `before` and `after` give their data
+# before and after it, or `None` when there was no task. `current` and
+# `previous` give the content of the CURRENT and PREVIOUS files, as
+# {"before": ..., "after": ...}. The before hooks only get the command.
+
+
+class Changes:
+
+    # key -> [before, after], for the tasks by selector and for the files of
+    # the state by name
+    def __init__(self):
+        self.tasks = {}
+        self.state = {}
+
+
+class HookEvent:
+
+    def __init__(self, hook, command, directory, readonly, changes=None,
+                 state=None):
+        self.hook = hook
+        self.command = command
+        self.directory = directory
+        self.readonly = readonly
+        tasks = changes.tasks if changes else {}
+        self.tasks = sorted(tasks)
+        self.before = {selector: change[0]
+                       for selector, change in tasks.items()}
+        self.after = {selector: change[1]
+                      for selector, change in tasks.items()}
+        state = state or {}
+        self.current = state.get('current')
+        self.previous = state.get('previous')
+
+    def to_json(self):
+        import json
+
+        return json.dumps({
+            'hook': self.hook,
+            'command': self.command,
+            'directory': self.directory,
+            'readonly': self.readonly,
+            'tasks': self.tasks,
+            'before': self.before,
+            'after': self.after,
+            'current': self.current,
+            'previous': self.previous,
+        })
+
+    def __repr__(self):
+        return "HookEvent(%s, %s, tasks=%s)" % (self.hook, self.command,
+                                                self.tasks)
+
+
+@contextmanager
+def event_env(payload):
+    # the environment of a script hook, with the file of its event
+    import tempfile
+
+    with tempfile.NamedTemporaryFile('w', prefix='dit-hook-',
+                                     suffix='.json') as f:
+        f.write(payload)
+        f.flush()
+        yield dict(os.environ, **{HOOK_EVENT_ENV: f.name})
+
+# ===========================================
+# Discovery
+#
+# The hooks of a dit directory are found with a single scan of ".hooks",
+# which is kept for as long as the mtime of the directory stays the same. So
+# the commands of a shell or of a server, which may scan it in advance, only
+# stat it. With no ".hooks", there is nothing else to do: the hooks of the
+# installed packages are only looked for in the dit directories that have
+# one, even if empty, so that the other commands never read the registry.
+
+_scans = {}
+
+
+def scan_hooks(base_path):
+    # names of the files in ".hooks", or `None` when there is no ".hooks"
+    path = os.path.join(base_path, HOOKS_DIR)
+    cached = _scans.get(path)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+        entries = list(os.scandir(path))
+    except OSError:
+        _scans.pop(path, None)
+        return None
+    names = frozenset(entry.name for entry in entries if entry.is_file())
+    _scans[path] = (mtime_ns, names)
+    return names
+
+# ===========================================
+# Python Hooks
+
+
+def _load_module_from(fp):
+    from importlib.util import module_from_spec, spec_from_file_location
+
+    spec = spec_from_file_location('dit_hooks', fp)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_python_hooks(base_path, names):
+    from .registry import entry_points, load_entry_point
+
+    sources = []
+    if PYTHON_HOOKS_FN in names:
+        fp = os.path.join(base_path, HOOKS_DIR, PYTHON_HOOKS_FN)
+        sources.append((os.path.join(HOOKS_DIR, PYTHON_HOOKS_FN),
+                        partial(_load_module_from, fp)))
+    for name, value in sorted(entry_points(HOOKS_ENTRY_POINTS).items()):
+        sources.append((name, partial(load_entry_point, value)))
+
+    modules = []
+    for name, load in sources:
+        try:
+            modules.append((name, load()))
+        except Exception as err:
+            raise DitError("Could not load the hooks of `%s`: %s"
+                           % (name, err))
+    return modules
+
+
+def call_python_hooks(modules, event, check):
+    for name, module in modules:
+        function = getattr(module, event.hook, None)
+        if not callable(function):
+            continue
+        msg.verbose("Executing hook: %s (%s)" % (event.hook, name))
+        with span("hook %s" % event.hook, "hook", source=name):
+            try:
+                function(event)
+            except Exception as err:
+                if check:
+                    raise DitError("Hook `%s` of `%s` failed: %s"
+                                   % (event.hook, name, err))
+                msg.warning("Hook `%s` of `%s` failed: %s"
+                            % (event.hook, name, err))
+
+
+def wants_changes(modules):
+    return any(callable(getattr(module, hook, None))
+               for __, module in modules
+               for hook in ["after", "after_read", "after_write"])
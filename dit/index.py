@@ -2,12 +2,17 @@
 
 import os
 
+from copy import deepcopy
+
 from . import messages as msg
 from .exceptions import DitError
+from .locking import directory_lock
+from .tracing import span
 
 from .common import (
     INDEX_FN,
     ROOT_NAME,
+    file_stamp,
     load_json_file,
     save_json_file,
     is_valid_task_name,
@@ -21,19 +26,60 @@ class Index():
     fp = None
     data = INITIAL_DATA
 
+    # when deferred, saving waits for `flush`
+    deferred = False
+    unsaved = False
+
+    # the file as loaded, and the changes made to it since, which are made
+    # again to the one saved meanwhile by another dit process, if any. They
+    # are `None` once rebuilt, as it then replaces it.
+    stamp = None
+    changes = None
+
     def load(self, base_path):
         self.base_path = base_path
         self.fp = os.path.join(self.base_path, INDEX_FN)
+        self.stamp = file_stamp(self.fp)
+        self.changes = []
         data = load_json_file(self.fp)
         if data:
             self.data = data
 
     def save(self):
+        if self.deferred:
+            self.unsaved = True
+            return
         if self.fp:
-            save_json_file(self.fp, self.data)
+            with directory_lock(self.base_path).writing():
+                if self.changes and file_stamp(self.fp) != self.stamp:
+                    self._merge()
+                save_json_file(self.fp, self.data)
+                self.stamp = file_stamp(self.fp)
+                self.changes = []
             msg.verbose("INDEX saved.")
 
+            from .completion import save_completion_cache
+            save_completion_cache(self.base_path, self.data)
+
+    def flush(self):
+        if self.unsaved:
+            deferred, self.deferred = self.deferred, False
+            self.unsaved = False
+            self.save()
+            self.deferred = deferred
+
+    def _merge(self):
+        self.data = load_json_file(self.fp) or deepcopy(INITIAL_DATA)
+        for change in self.changes:
+            change[0](*change[1:])
+        msg.verbose("INDEX merged with the one saved meanwhile.")
+
     def add(self, group, subgroup, task):
+        if self.changes is not None:
+            self.changes.append((self._add, group, subgroup, task))
+        self._add(group, subgroup, task)
+
+    def _add(self, group, subgroup, task):
         group_id = -1
         for i in range(len(self.data)):
             if self.data[i][0] == group:
@@ -52,9 +98,16 @@ class Index():
             subgroup_id = len(self.data[group_id][1])
             self.data[group_id][1].append([subgroup, []])
 
-        self.data[group_id][1][subgroup_id][1].append(task)
+        tasks = self.data[group_id][1][subgroup_id][1]
+        if task not in tasks:
+            tasks.append(task)
 
     def remove(self, group, subgroup, task):
+        if self.changes is not None:
+            self.changes.append((self._remove, group, subgroup, task))
+        self._remove(group, subgroup, task)
+
+    def _remove(self, group, subgroup, task):
         for g in self.data:
             if g[0] == group:
                 for s in g[1]:
@@ -67,7 +120,12 @@ class Index():
                 break
 
     def rebuild(self):
-        self.data = INITIAL_DATA
+        with span("index.rebuild", "storage"):
+            self._rebuild()
+        self.changes = None
+
+    def _rebuild(self):
+        self.data = deepcopy(INITIAL_DATA)
         c_group = ROOT_NAME
         c_subgroup = ROOT_NAME
         for root, dirs, files in os.walk(self.base_path):
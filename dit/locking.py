@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+from contextlib import contextmanager
+
+from .exceptions import DitError
+
+# ===========================================
+# Constants
+
+LOCK_TIMEOUT_ENV = 'DIT_LOCK_TIMEOUT'
+DEFAULT_LOCK_TIMEOUT = 10
+
+# seconds between two attempts to lock a task
+LOCK_POLL_DELAY = 0.05
+
+# ===========================================
+# Locks
+#
+# Several dit processes may run at once on the same dit directory, e.g.
+# hooks, cron exports and shells, so its files are locked with `flock`:
+#
+# - listing commands hold a shared lock of the dit directory while they run;
+# - the index and the state files are written while holding an exclusive
+#   lock of the dit directory, which is released as soon as they are. Those
+#   saved meanwhile by another command are loaded again under it, and the
+#   changes made to them by this one are made again (see `Index.save` and
+#   `Dit._write_previous`), so it is never held while the command waits for
+#   an editor or a fetcher;
+# - the other commands hold an exclusive lock of each task they load or save
+#   until they are done, so that they never undo the changes made to it by
+#   another one. It is a hidden file next to the task, ".<task>.lock", which
+#   is waited for up to DIT_LOCK_TIMEOUT seconds, and removed once released.
+#
+# Besides, files are written to a temporary file which is then renamed over
+# them (see `write_file` in common), so that no reader sees part of one.
+#
+# When the lock files cannot be created, e.g. in a read-only dit directory,
+# the tasks are not locked.
+
+_directory_locks = {}
+
+
+def lock_timeout():
+    try:
+        return max(0.0, float(os.environ.get(LOCK_TIMEOUT_ENV) or
+                              DEFAULT_LOCK_TIMEOUT))
+    except ValueError:
+        return DEFAULT_LOCK_TIMEOUT
+
+
+class DirectoryLock:
+
+    # a single one for each dit directory, so that the exclusive sections of
+    # a command convert its shared lock instead of waiting for it
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.fd = None
+        self.shared = 0
+        self.exclusive = 0
+
+    def _flock(self, operation):
+        import fcntl
+
+        if self.fd is None:
+            try:
+                self.fd = os.open(self.base_path, os.O_RDONLY)
+            except OSError:
+                # not created yet
+                return
+        fcntl.flock(self.fd, operation)
+
+    def _release(self):
+        import fcntl
+
+        self._flock(fcntl.LOCK_SH if self.shared else fcntl.LOCK_UN)
+
+    @contextmanager
+    def reading(self):
+        import fcntl
+
+        if not self.shared and not self.exclusive:
+            self._flock(fcntl.LOCK_SH)
+        self.shared += 1
+        try:
+            yield
+        finally:
+            self.shared -= 1
+            if not self.shared and not self.exclusive:
+                self._release()
+
+    @contextmanager
+    def writing(self):
+        import fcntl
+
+        if not self.exclusive:
+            self._flock(fcntl.LOCK_EX)
+        self.exclusive += 1
+        try:
+            yield
+        finally:
+            self.exclusive -= 1
+            if not self.exclusive:
+                self._release()
+
+
+def directory_lock(base_path):
+    key = os.path.abspath(base_path)
+    if key not in _directory_locks:
+        _directory_locks[key] = DirectoryLock(base_path)
+    return _directory_locks[key]
+
+
+class TaskLocks:
+
+    # the exclusive locks of the tasks held by a command
+    def __init__(self):
+        self.files = {}
+        self.timeout = lock_timeout()
+
+    def _try_lock(self, lock_fp):
+        # the open lock file, `False` when locked by another process, or
+        # `None` when it cannot be created
+        import fcntl
+
+        try:
+            f = open(lock_fp, 'a+')
+        except OSError:
+            return None
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # unless it was removed by the process that held it
+            if os.fstat(f.fileno()).st_ino == os.stat(lock_fp).st_ino:
+                return f
+        except OSError:
+            pass
+        f.close()
+        return False
+
+    def lock(self, task_fp):
+        directory, name = os.path.split(task_fp)
+        lock_fp = os.path.join(directory, '.%s.lock' % name)
+        if lock_fp in self.files:
+            return
+        deadline = time.monotonic() + self.timeout
+        while True:
+            f = self._try_lock(lock_fp)
+            if f is None:
+                return
+            if f:
+                break
+            if time.monotonic() >= deadline:
+                raise DitError("Task is locked by another dit process: %s"
+                               % task_fp)
+            time.sleep(LOCK_POLL_DELAY)
+        self.files[lock_fp] = f
+
+    def release(self):
+        for lock_fp, f in self.files.items():
+            try:
+                os.remove(lock_fp)
+            except OSError:
+                pass
+            f.close()
+        self.files = {}
@@ -4,11 +4,17 @@ from sys import stderr, stdout
 
 _verbose = False
 
-_warning_str = ('\033[0;101;37mWARNIG:\033[0m' if stderr.isatty()
-                else "WARNING:")
 
-_error_str = ('\033[0;41;37mERROR:\033[0m' if stderr.isatty()
-              else "ERROR:")
+# stderr is checked each time, since `dit serve` runs commands with the
+# stderr of its clients
+def _warning_str():
+    return ('\033[0;101;37mWARNIG:\033[0m' if stderr.isatty()
+            else "WARNING:")
+
+
+def _error_str():
+    return ('\033[0;41;37mERROR:\033[0m' if stderr.isatty()
+            else "ERROR:")
 
 
 def _flush_stdout():
@@ -22,6 +28,11 @@ def turn_verbose_on():
     _verbose = True
 
 
+def turn_verbose_off():
+    global _verbose
+    _verbose = False
+
+
 def normal(message=''):
     print(message)
 
@@ -37,11 +48,11 @@ def yn_question(question):
 
 def warning(message):
     _flush_stdout()
-    stderr.write("%s %s\n" % (_warning_str, message))
+    stderr.write("%s %s\n" % (_warning_str(), message))
 
 
 def error(message):
     _flush_stdout()
-    stderr.write("%s %s\n" % (_error_str, message))
+    stderr.write("%s %s\n" % (_error_str(), message))
 
 
@@ -1,18 +1,18 @@
 # -*- coding: utf-8 -*-
 
-from datetime import datetime
-
 from .dit import State, state
-from .utils import DATETIME_FORMAT
+
+DATETIMES = True
 
 _file = None
-_options = {
+_DEFAULT_OPTIONS = {
     'concluded': False,
 }
+_options = dict(_DEFAULT_OPTIONS)
 
 
-def _(string):
-    return datetime.strptime(string, DATETIME_FORMAT).strftime(r'%Y-%m-%d %a %H:%M')
+def _(dt):
+    return dt.strftime(r'%Y-%m-%d %a %H:%M')
 
 
 def _get_state(data):
@@ -33,7 +33,7 @@ def setup(file, options):
     global _file
     global _options
     _file = file
-    _options.update(options)
+    _options = dict(_DEFAULT_OPTIONS, **options)
 
 
 def begin():
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from functools import wraps
+
+# ===========================================
+# Constants
+
+# the functions of an exporter that are measured
+EXPORTER_CALLBACKS = [
+    'setup',
+    'fields',
+    'begin',
+    'group',
+    'subgroup',
+    'task',
+    'end',
+]
+
+# ===========================================
+# Profiler
+#
+# Keeps the wall-clock time and the number of calls of the phases of a
+# command. The functions of the phases are only replaced by measured ones
+# while profiling, so that nothing is measured otherwise. Nested phases are
+# counted in the time of both.
+
+
+class Profiler:
+
+    def __init__(self):
+        self.phases = {}
+        self.calls = []
+        self.patched = []
+        self.started_at = time.perf_counter()
+        self.stopped_at = None
+
+    def record(self, name, start, end):
+        phase = self.phases.setdefault(name, [0, 0.0])
+        phase[0] += 1
+        phase[1] += end - start
+        self.calls.append([name, start - self.started_at, end - start])
+
+    def wrap(self, function, name):
+        # `name` may also be a function giving it from the arguments
+        @wraps(function)
+        def measured(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(name(*args, **kwargs) if callable(name) else name,
+                            start, time.perf_counter())
+        return measured
+
+    def patch(self, owner, attribute, name):
+        original = getattr(owner, attribute)
+        self.patched.append((owner, attribute, original))
+        setattr(owner, attribute, self.wrap(original, name))
+
+    def patch_exporter(self, exporter):
+        for callback in EXPORTER_CALLBACKS:
+            if callable(getattr(exporter, callback, None)):
+                self.patch(exporter, callback, 'exporter.%s' % callback)
+
+    def stop(self):
+        self.stopped_at = time.perf_counter()
+        for owner, attribute, original in reversed(self.patched):
+            setattr(owner, attribute, original)
+        self.patched = []
+
+    # Output
+
+    def total(self):
+        return (self.stopped_at or time.perf_counter()) - self.started_at
+
+    def summary(self):
+        rows = sorted(self.phases.items(), key=lambda item: -item[1][1])
+        width = max([len(name) for name in self.phases] + [len('phase')])
+        lines = ['%-*s %8s %10s %10s' % (width, 'phase', 'calls', 'total',
+                                         'mean')]
+        for name, (calls, seconds) in rows:
+            lines.append('%-*s %8d %8.2fms %8.3fms'
+                         % (width, name, calls, seconds * 1000,
+                            seconds * 1000 / calls))
+        lines.append('%-*s %8s %8.2fms' % (width, 'total', '',
+                                           self.total() * 1000))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, fp):
+        import json
+
+        with open(fp, 'w') as f:
+            json.dump({
+                'total': self.total(),
+                'phases': {name: {'calls': calls, 'seconds': seconds}
+                           for name, (calls, seconds) in self.phases.items()},
+                'calls': self.calls,
+            }, f)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+from .common import cache_home, file_stamp, load_json_file, save_json_file
+
+# ===========================================
+# Constants
+
+ENTRY_POINTS_FN = 'entry_points-%s.json'
+ENTRY_POINTS_VERSION = 2
+
+EXPORTERS_ENTRY_POINTS = 'dit.exporters'
+
+# only the groups of dit are kept
+GROUP_PREFIX = 'dit.'
+
+# ===========================================
+# Entry Points
+#
+# Looking up the entry points of the installed distributions reads the
+# metadata of every one of them, which takes longer than running most
+# commands. So those of dit are kept in a file of the cache home, along with
+# the stat of each directory of `sys.path`: installing or removing a
+# distribution changes the directory it goes in. Whether the modules that
+# plugins may be found as (e.g. "dit_Xexporter") exist is kept there too, as
+# looking them up scans `sys.path`.
+#
+# There is one such file for each interpreter and `sys.path`, so that
+# virtualenvs do not replace each other's. The working directory, which is
+# first in `sys.path` for "python -m dit", is left out of both.
+
+_registry = None
+
+
+def _search_paths():
+    paths = [path for path in sys.path if path]
+    try:
+        if paths and sys.path[0] and \
+                os.path.abspath(sys.path[0]) == os.getcwd():
+            paths.pop(0)
+    except OSError:
+        pass
+    return paths
+
+
+def _path_stamps():
+    return [[path, file_stamp(path)] for path in _search_paths()]
+
+
+def _scan_entry_points():
+    try:
+        from importlib.metadata import distributions
+    except ImportError:
+        return _scan_legacy_entry_points()
+
+    groups = {}
+    seen = set()
+    for dist in distributions():
+        # the first of a distribution in `sys.path` is the one imported
+        name = dist.metadata['Name']
+        if name in seen:
+            continue
+        seen.add(name)
+        for entry_point in dist.entry_points:
+            if entry_point.group.startswith(GROUP_PREFIX):
+                group = groups.setdefault(entry_point.group, {})
+                group.setdefault(entry_point.name, entry_point.value)
+    return groups
+
+
+def _scan_legacy_entry_points():
+    try:
+        import pkg_resources
+    except ImportError:
+        return {}
+
+    groups = {}
+    for dist in pkg_resources.working_set:
+        for group, entry_points in dist.get_entry_map().items():
+            if group.startswith(GROUP_PREFIX):
+                for name, entry_point in entry_points.items():
+                    value = entry_point.module_name
+                    if entry_point.attrs:
+                        value += ':' + '.'.join(entry_point.attrs)
+                    groups.setdefault(group, {}).setdefault(name, value)
+    return groups
+
+
+def _registry_path():
+    import hashlib
+
+    key = '\n'.join([sys.prefix, sys.executable] + _search_paths())
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(cache_home(), ENTRY_POINTS_FN % digest[:16])
+
+
+def _save_registry(registry):
+    fp = _registry_path()
+    try:
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        save_json_file(fp, registry)
+    except OSError:
+        # looked up again next time
+        pass
+
+
+def _load_registry():
+    stamps = _path_stamps()
+    try:
+        cached = load_json_file(_registry_path())
+    except ValueError:
+        cached = None
+    if cached and cached.get('version') == ENTRY_POINTS_VERSION and \
+            cached.get('stamps') == stamps:
+        return cached
+
+    registry = {
+        'version': ENTRY_POINTS_VERSION,
+        'stamps': stamps,
+        'groups': _scan_entry_points(),
+        'modules': {},
+    }
+    _save_registry(registry)
+    return registry
+
+
+def _get_registry():
+    global _registry
+    if _registry is None:
+        _registry = _load_registry()
+    return _registry
+
+
+def entry_points(group):
+    # name -> "module:attribute"
+    return _get_registry()['groups'].get(group, {})
+
+
+def module_exists(name):
+    from importlib.util import find_spec
+
+    modules = _get_registry()['modules']
+    if name not in modules:
+        try:
+            modules[name] = find_spec(name) is not None
+        except (ImportError, ValueError):
+            modules[name] = False
+        _save_registry(_registry)
+    return modules[name]
+
+
+def load_entry_point(value):
+    from importlib import import_module
+
+    module_name, __, attributes = value.partition(':')
+    obj = import_module(module_name.strip())
+    for attribute in attributes.strip().split('.') if attributes else []:
+        obj = getattr(obj, attribute)
+    return obj
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+import array
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from importlib import import_module
+
+from . import messages as msg
+
+from .cache import TASK_CACHE_RACY_NS, TaskCache, load_task_cache
+from .client import (
+    COMPLETION,
+    STOP,
+    connect,
+    decode_request,
+    send_request,
+    server_path,
+    wait_response,
+)
+from .common import (
+    CURRENT_FN,
+    INDEX_FN,
+    PRELOADED,
+    PREVIOUS_FN,
+    file_stamp,
+    load_json_file,
+    path_to_string,
+)
+from .exceptions import DitError
+from .hooks import scan_hooks
+
+# ===========================================
+# Constants
+
+# how often the dit directory is checked for changes while idle
+WATCH_INTERVAL = 1
+
+MAX_REQUEST_CHUNK = 64 * 1024
+
+# imported in advance, since most commands need them
+WARM_MODULES = [
+    'dit.completion',
+    'dit.dit_exporter',
+    'dit.hooks',
+    'dit.org_exporter',
+    'subprocess',
+]
+
+# ===========================================
+# Warm State
+#
+# The state files of the dit directory and the task cache are kept loaded
+# (see `PRELOADED` in common), and loaded again whenever they change. Files
+# modified very recently are left alone, as they may change again without
+# their stat changing. The hooks are scanned in advance too.
+
+
+class WarmState:
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        base_path = os.path.abspath(base_path)
+        self.loaders = [
+            (os.path.join(base_path, INDEX_FN), load_json_file),
+            (os.path.join(base_path, CURRENT_FN), load_json_file),
+            (os.path.join(base_path, PREVIOUS_FN), load_json_file),
+        ] + [
+            (os.path.abspath(fp), load_task_cache)
+            for fp in TaskCache(base_path).shard_paths()
+        ]
+
+    def refresh(self):
+        now_ns = int(time.time() * 10**9)
+        for fp, load in self.loaders:
+            stamp = file_stamp(fp)
+            preloaded = PRELOADED.get(fp)
+            if preloaded and preloaded[0] == stamp:
+                continue
+            PRELOADED.pop(fp, None)
+            if stamp is None or now_ns - stamp[0] <= TASK_CACHE_RACY_NS:
+                continue
+            try:
+                data = load(fp)
+            except ValueError:
+                # invalid, the command will complain about it
+                continue
+            if data is not None:
+                PRELOADED[fp] = (stamp, data)
+        scan_hooks(self.base_path)
+
+# ===========================================
+# Requests
+
+
+def _receive_request(conn):
+    fds = array.array('i')
+    data, ancdata, __, __ = conn.recvmsg(
+        MAX_REQUEST_CHUNK, socket.CMSG_LEN(3 * fds.itemsize))
+    for level, kind, cdata in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cdata[:len(cdata) - len(cdata) % fds.itemsize])
+
+    while len(data) < 4 or len(data) < 4 + int.from_bytes(data[:4], 'big'):
+        chunk = conn.recv(MAX_REQUEST_CHUNK)
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return decode_request(data[4:]) + (list(fds),)
+
+
+def _exit_code(err):
+    # as the interpreter does on exit
+    if err.code is None:
+        return 0
+    if isinstance(err.code, int):
+        return err.code & 0xff
+    sys.stderr.write('%s\n' % err.code)
+    return 1
+
+
+def _run(kind, argv):
+    from dit.dit import reset_general_options
+
+    reset_general_options()
+    try:
+        if kind == COMPLETION:
+            from dit import run_completion
+            run_completion(argv)
+        else:
+            from dit import run
+            run(argv)
+    except SystemExit as err:
+        return _exit_code(err)
+    except KeyboardInterrupt:
+        traceback.print_exc()
+        return 128 + signal.SIGINT
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def _run_forked(conn, kind, cwd, argv, env, fds):
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(line_buffering=sys.stdout.isatty())
+    os.chdir(cwd)
+    os.environb.clear()
+    os.environb.update(env)
+
+    conn.sendall(b'%d\n' % os.getpid())
+    code = _run(kind, argv)
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    except OSError:
+        pass
+    conn.sendall(b'%d\n' % code)
+    return code
+
+
+def _handle(sock, conn):
+    try:
+        (kind, cwd, argv, env, fds) = _receive_request(conn)
+    except (OSError, EOFError, ValueError):
+        # a broken request, the client gets no exit code
+        return True
+
+    if kind == STOP or len(fds) != 3:
+        for fd in fds:
+            os.close(fd)
+        conn.sendall(b'%d\n%d\n' % (os.getpid(), 0 if kind == STOP else 1))
+        return kind != STOP
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            sock.close()
+            code = _run_forked(conn, kind, cwd, argv, env, fds)
+        finally:
+            os._exit(code)
+
+    for fd in fds:
+        os.close(fd)
+    return True
+
+# ===========================================
+# Server
+
+
+def _stop_serving(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def serve(base_path):
+    path = server_path(base_path)
+    running = connect(base_path)
+    if running:
+        running.close()
+        raise DitError("Already serving: %s" % path_to_string(base_path))
+    if os.path.exists(path):
+        os.remove(path)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # only the user may connect
+    umask = os.umask(0o177)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(umask)
+    sock.listen(16)
+
+    # children report their own exit code, they are never waited for
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _stop_serving)
+
+    for module in WARM_MODULES:
+        import_module(module)
+
+    warm = WarmState(base_path)
+    msg.verbose("Serving: %s" % path_to_string(base_path))
+    try:
+        serving = True
+        while serving:
+            readable = select.select([sock], [], [], WATCH_INTERVAL)[0]
+            warm.refresh()
+            if readable:
+                conn = sock.accept()[0]
+                with conn:
+                    serving = _handle(sock, conn)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        os.remove(path)
+    msg.verbose("Stopped serving: %s" % path_to_string(base_path))
+
+
+def stop(base_path):
+    sock = connect(base_path)
+    if not sock:
+        raise DitError("Not serving: %s" % path_to_string(base_path))
+    with sock:
+        send_request(sock, STOP, [])
+        wait_response(sock)
+    msg.verbose("Server stopped.")
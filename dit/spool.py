@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+import time
+
+from .common import ASYNC_HOOK_EXT, HOOKS_DIR, load_json_file
+from .hooks import event_env
+
+# ===========================================
+# Constants
+
+SPOOL_DIR = 'spool'
+FAILED_DIR = 'failed'
+LOCK_FN = 'worker.lock'
+LOG_FN = 'worker.log'
+EVENT_EXT = '.json'
+
+# the after hooks that may run detached, as scripts named "<hook>.async"
+ASYNC_HOOKS = ['after', 'after_read', 'after_write']
+
+JOBS_ENV = 'DIT_HOOK_JOBS'
+DEFAULT_JOBS = 4
+
+# seconds to wait before each retry of a failed event
+RETRY_DELAYS = [1, 5, 30]
+
+LOG_MAX_BYTES = 1024 * 1024
+
+# ===========================================
+# Spool
+#
+# An asynchronous hook gets its events through a queue: a directory of the
+# spool, named after the hook, with a file for each event. Their names sort
+# in the order in which they were queued. They are written under another
+# name first, so that the worker never reads a partial one.
+
+
+def spool_path(base_path, *names):
+    return os.path.join(base_path, HOOKS_DIR, SPOOL_DIR, *names)
+
+
+def _make_dirs(path):
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+
+def enqueue(base_path, hook, cmd_name, payload):
+    queue_path = spool_path(base_path, hook)
+    _make_dirs(queue_path)
+    queued_ns = int(time.time() * 10**9)
+    name = '%020d-%d' % (queued_ns, os.getpid())
+    event = {
+        'hook': hook,
+        'command': cmd_name,
+        'queued_at': queued_ns,
+        'attempts': 0,
+        'payload': payload,
+    }
+    tmp_fp = os.path.join(queue_path, '.' + name)
+    with open(tmp_fp, 'w') as f:
+        json.dump(event, f)
+    os.replace(tmp_fp, os.path.join(queue_path, name + EVENT_EXT))
+
+
+def _queued(queue_path):
+    try:
+        names = os.listdir(queue_path)
+    except OSError:
+        return []
+    return sorted(name for name in names
+                  if name.endswith(EVENT_EXT) and not name.startswith('.'))
+
+
+def queues(base_path):
+    return [hook for hook in ASYNC_HOOKS
+            if _queued(spool_path(base_path, hook))]
+
+# ===========================================
+# Worker
+#
+# A single worker drains the queues of a dit directory, which is told by a
+# lock on a file of the spool. Each queue is drained in order by one thread,
+# so that the events of a hook are handled one at a time, in the order they
+# were queued; up to DIT_HOOK_JOBS queues are drained at once. A failed event
+# is retried after a delay, which holds back the following ones of its hook,
+# and it is set aside in "failed" once it has failed too many times.
+
+
+def _try_lock(fp, blocking=False):
+    import fcntl
+
+    _make_dirs(os.path.dirname(fp))
+    f = open(fp, 'a+')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def worker_pid(base_path):
+    # `None` when no worker is running
+    lock_fp = spool_path(base_path, LOCK_FN)
+    if not os.path.exists(lock_fp):
+        return None
+    lock = _try_lock(lock_fp)
+    if lock is not None:
+        lock.close()
+        return None
+    try:
+        with open(lock_fp, 'r') as f:
+            return int(f.read().strip() or 0) or None
+    except (OSError, ValueError):
+        return None
+
+
+def start_worker(base_path):
+    import subprocess
+
+    if worker_pid(base_path) is not None:
+        return
+    log_fp = spool_path(base_path, LOG_FN)
+    try:
+        if os.path.getsize(log_fp) > LOG_MAX_BYTES:
+            os.replace(log_fp, log_fp + '.1')
+    except OSError:
+        pass
+    # the same dit, even when not installed
+    env = dict(os.environ)
+    package_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package_path] + [path for path in [env.get('PYTHONPATH')] if path])
+    with open(os.devnull, 'r') as devnull, open(log_fp, 'a') as log:
+        subprocess.Popen([sys.executable, '-m', 'dit.spool',
+                          os.path.abspath(base_path)],
+                         stdin=devnull, stdout=log, stderr=log, env=env,
+                         close_fds=True, start_new_session=True)
+
+
+def _log(message):
+    sys.stdout.write('[%s] %s\n' % (time.strftime('%Y-%m-%d %H:%M:%S'),
+                                    message))
+    sys.stdout.flush()
+
+
+def _run_event(base_path, event):
+    import subprocess
+
+    hook_fp = os.path.join(base_path, HOOKS_DIR,
+                           event['hook'] + ASYNC_HOOK_EXT)
+    if not os.path.isfile(hook_fp):
+        return None
+    with event_env(event.get('payload') or '') as env:
+        return subprocess.run([hook_fp, base_path, event['command']],
+                              env=env).returncode
+
+
+def _drain_queue(base_path, hook):
+    queue_path = spool_path(base_path, hook)
+    while True:
+        names = _queued(queue_path)
+        if not names:
+            return
+        event_fp = os.path.join(queue_path, names[0])
+        try:
+            event = load_json_file(event_fp)
+        except ValueError:
+            event = None
+        if not event:
+            _set_aside(base_path, hook, names[0], "invalid event")
+            continue
+
+        code = _run_event(base_path, event)
+        if code is None:
+            _log("%s %s: no such hook, dropped" % (hook, event['command']))
+            os.remove(event_fp)
+            continue
+        if code == 0:
+            _log("%s %s: done" % (hook, event['command']))
+            os.remove(event_fp)
+            continue
+
+        event['attempts'] += 1
+        if event['attempts'] > len(RETRY_DELAYS):
+            _set_aside(base_path, hook, names[0],
+                       "failed with code %d" % code)
+            continue
+        delay = RETRY_DELAYS[event['attempts'] - 1]
+        _log("%s %s: failed with code %d, retrying in %ds"
+             % (hook, event['command'], code, delay))
+        with open(event_fp, 'w') as f:
+            json.dump(event, f)
+        time.sleep(delay)
+
+
+def _set_aside(base_path, hook, name, reason):
+    failed_path = spool_path(base_path, FAILED_DIR)
+    _make_dirs(failed_path)
+    os.replace(spool_path(base_path, hook, name),
+               os.path.join(failed_path, '%s-%s' % (hook, name)))
+    _log("%s: %s, set aside as %s-%s" % (hook, reason, hook, name))
+
+
+def _jobs():
+    try:
+        return max(1, int(os.environ.get(JOBS_ENV, DEFAULT_JOBS)))
+    except ValueError:
+        return DEFAULT_JOBS
+
+
+def drain(base_path, blocking=False):
+    from concurrent.futures import ThreadPoolExecutor
+    from functools import partial
+
+    lock_fp = spool_path(base_path, LOCK_FN)
+    while True:
+        lock = _try_lock(lock_fp, blocking)
+        if lock is None:
+            # the running worker drains them
+            return False
+        try:
+            lock.seek(0)
+            lock.truncate()
+            lock.write('%d\n' % os.getpid())
+            lock.flush()
+            hooks = queues(base_path)
+            if hooks:
+                with ThreadPoolExecutor(min(_jobs(), len(hooks))) as pool:
+                    list(pool.map(partial(_drain_queue, base_path), hooks))
+        finally:
+            lock.seek(0)
+            lock.truncate()
+            lock.close()
+        # events queued while the worker was about to stop
+        if not queues(base_path):
+            return True
+
+# ===========================================
+# Status
+
+
+def retry(base_path):
+    failed_path = spool_path(base_path, FAILED_DIR)
+    count = 0
+    for name in _queued(failed_path):
+        hook, __, event_name = name.partition('-')
+        if hook not in ASYNC_HOOKS:
+            continue
+        event_fp = os.path.join(failed_path, name)
+        try:
+            event = load_json_file(event_fp)
+        except ValueError:
+            continue
+        event['attempts'] = 0
+        _make_dirs(spool_path(base_path, hook))
+        with open(event_fp, 'w') as f:
+            json.dump(event, f)
+        os.replace(event_fp, spool_path(base_path, hook, event_name))
+        count += 1
+    return count
+
+
+def status(base_path):
+    # [(hook, pending, failed)]
+    failed = os.listdir(spool_path(base_path, FAILED_DIR)) \
+        if os.path.isdir(spool_path(base_path, FAILED_DIR)) else []
+    return [(hook,
+             len(_queued(spool_path(base_path, hook))),
+             len([name for name in failed if name.startswith(hook + '-')]))
+            for hook in ASYNC_HOOKS]
+
+
+if __name__ == '__main__':
+    drain(sys.argv[1])
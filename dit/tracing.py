@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+from _thread import get_ident
+
+# ===========================================
+# Constants
+
+TRACE_ENV = 'DIT_TRACE'
+
+# ===========================================
+# Tracing
+#
+# When the DIT_TRACE environment variable gives a file, the spans measured
+# while running a command are appended to it as Chrome trace events, in the
+# JSON array format, which may be left unterminated. So several processes,
+# e.g. dit called from a hook, may trace to the same file.
+#
+# Plugins may measure their own spans:
+#
+#     from dit.tracing import span
+#
+#     with span("my work", "exporter", task=task):
+#         ...
+
+_trace_fp = None
+_events = None
+
+
+class _Span:
+
+    __slots__ = ['name', 'category', 'args', 'start']
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = _now_us()
+        if _events is not None:
+            _events.append({
+                'name': self.name,
+                'cat': self.category,
+                'ph': 'X',
+                'ts': self.start,
+                'dur': end - self.start,
+                'pid': os.getpid(),
+                'tid': get_ident(),
+                'args': self.args,
+            })
+        return False
+
+
+class _NoSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def _now_us():
+    # wall-clock, so that the events of several processes line up
+    return int(time.time() * 10**6)
+
+
+def span(name, category='dit', **args):
+    if _events is None:
+        return _NO_SPAN
+    return _Span(name, category, args)
+
+
+def enabled():
+    return _events is not None
+
+
+def start(description):
+    global _trace_fp
+    global _events
+    _trace_fp = os.environ.get(TRACE_ENV)
+    if not _trace_fp:
+        _events = None
+        return
+    _events = [{
+        'name': 'process_name',
+        'ph': 'M',
+        'pid': os.getpid(),
+        'args': {'name': description},
+    }]
+
+
+def stop():
+    global _events
+    if _events is None:
+        return
+    events, _events = _events, None
+
+    import json
+
+    content = ''.join(json.dumps(event) + ',\n' for event in events)
+    try:
+        with open(_trace_fp, 'a') as f:
+            if f.tell() == 0:
+                f.write('[\n')
+            f.write(content)
+    except OSError as err:
+        from . import messages as msg
+        msg.warning("Could not write the trace: %s" % err)
+
+# ===========================================
+# Modules
+#
+# Calls to the functions of a module (e.g. an exporter) are measured through
+# a `TracedModule` standing for it.
+
+
+class TracedModule:
+
+    def __init__(self, module, category):
+        self._module = module
+        self._category = category
+
+    def __getattr__(self, name):
+        value = getattr(self._module, name)
+        if not callable(value):
+            return value
+        span_name = '%s.%s' % (self._module.__name__, name)
+        category = self._category
+
+        def traced(*args, **kwargs):
+            with span(span_name, category):
+                return value(*args, **kwargs)
+        return traced
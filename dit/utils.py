@@ -3,9 +3,18 @@
 import re
 import os
 from datetime import datetime, timedelta, timezone
-from tzlocal import get_localzone
 
+from .common import (
+    FIELD_DATES,
+    FIELD_LOGBOOK,
+    FIELD_NOTES,
+    FIELD_PROPERTIES,
+    FIELD_STATE,
+    FIELD_TITLE,
+    FIELD_TOTALS,
+)
 from .exceptions import ArgumentError
+from .tracing import span
 
 # Auxiliary
 
@@ -27,6 +36,24 @@ def td2str(td):
     return s
 
 
+# Live durations are time spent values that keep growing because of an open
+# logbook entry. They can be written marked, so that they can be brought up to
+# date later on.
+
+LIVE_MARK = '\0'
+LIVE_PATTERN = re.compile(LIVE_MARK + r'(?P<seconds>[0-9.]+)' + LIVE_MARK)
+
+
+def live_td2str(td):
+    return '%s%f%s' % (LIVE_MARK, td.total_seconds(), LIVE_MARK)
+
+
+def render_live(string, elapsed=timedelta()):
+    def render(match):
+        return td2str(timedelta(seconds=float(match.group('seconds'))) + elapsed)
+    return LIVE_PATTERN.sub(render, string)
+
+
 def dt2str(dt):
     return dt.strftime(DATETIME_FORMAT)
 
@@ -40,9 +67,12 @@ def str2dt(string):
 # integer
 if os.path.isfile('DIT_TESTING'):
 
-    LOCALZONE = timezone(timedelta(-1, 79200), 'BRST')
+    _local_zone = timezone(timedelta(-1, 79200), 'BRST')
+
+    def local_zone():
+        return _local_zone
 
-    _base_now = datetime(2016, 9, 10, 18, 50, 43, 0, LOCALZONE)
+    _base_now = datetime(2016, 9, 10, 18, 50, 43, 0, _local_zone)
 
     def now(inc=1):
         with open('DIT_TESTING', 'r') as f:
@@ -60,10 +90,19 @@ if os.path.isfile('DIT_TESTING'):
 
 
 else:
-    LOCALZONE = get_localzone()
+    _local_zone = None
+
+    # finding the zone takes a while, so it is only done by commands that
+    # need the local time and the result is cached
+    def local_zone():
+        global _local_zone
+        if _local_zone is None:
+            from .cache import load_local_zone
+            _local_zone = load_local_zone()
+        return _local_zone
 
     def now(**kwargs):
-        return datetime.now(LOCALZONE)
+        return datetime.now(local_zone())
 
     def today():
         return now().replace(hour=0,
@@ -87,16 +126,131 @@ def time_spent_on(logbook):
     return time_spent
 
 
+def _maybe_str2dt(value):
+    # data may have been converted already
+    if isinstance(value, str):
+        return str2dt(value)
+    return value
+
+
 def convert_datetimes(data):
     for key in ['created_at', 'updated_at', 'concluded_at']:
         if key in data:
-            data[key] = str2dt(data[key])
+            data[key] = _maybe_str2dt(data[key])
     logbook = data.get('logbook', [])
     for log in logbook:
-        log['in'] = str2dt(log['in'])
-        log['out'] = str2dt(log['out']) if log['out'] else None
+        log['in'] = _maybe_str2dt(log['in'])
+        log['out'] = _maybe_str2dt(log['out']) if log['out'] else None
     return data
 
+# ===========================================
+# Projections
+#
+# Fields are kept as a dict from field name to `None`, except for the logbook
+# whose value is the number of last entries needed, `None` meaning all of them.
+
+SUMMARY_LOGBOOK_LEN = 3
+
+SUMMARY_FIELDS = [FIELD_TITLE, FIELD_STATE, FIELD_DATES, FIELD_TOTALS]
+
+
+def parse_fields(fields):
+    parsed = {}
+    for field in fields:
+        name, __, n = field.partition(':')
+        parsed = merge_fields(parsed, {name: int(n) if n else None})
+    return parsed
+
+
+def merge_fields(fields, other):
+    merged = dict(fields)
+    for name, n in other.items():
+        if name in merged and (merged[name] is None or n is None):
+            merged[name] = None
+        elif name in merged:
+            merged[name] = max(merged[name], n)
+        else:
+            merged[name] = n
+    return merged
+
+
+def filter_fields(filters):
+    fields = []
+    if 'where' in filters:
+        fields.append(FIELD_PROPERTIES)
+    if 'from' in filters or 'to' in filters:
+        fields += [FIELD_DATES, FIELD_LOGBOOK]
+    return fields
+
+
+def is_summary_projection(fields):
+    for name, n in fields.items():
+        if name == FIELD_LOGBOOK:
+            if n is None or n > SUMMARY_LOGBOOK_LEN:
+                return False
+        elif name not in SUMMARY_FIELDS:
+            return False
+    return True
+
+
+def summarize(data):
+    # data must be converted
+    logbook = data.get('logbook', [])
+    summary = {key: data[key]
+               for key in ['title', 'created_at', 'updated_at', 'concluded_at']
+               if key in data}
+    summary['logbook'] = logbook[-SUMMARY_LOGBOOK_LEN:]
+    summary['closed_time_spent'] = time_spent_on([log for log in logbook
+                                                  if log['out']])
+    summary['open_logbook'] = [log for log in logbook if not log['out']]
+    return summary
+
+
+def _convert_log(log):
+    return {'in': _maybe_str2dt(log['in']),
+            'out': _maybe_str2dt(log['out']) if log['out'] else None}
+
+
+def project(source, fields):
+    # source is task data, converted or not, or a task summary; only what is
+    # projected gets converted
+    projected = {}
+
+    if FIELD_TITLE in fields and 'title' in source:
+        projected['title'] = source['title']
+
+    date_keys = []
+    if FIELD_STATE in fields or FIELD_DATES in fields:
+        date_keys.append('concluded_at')
+    if FIELD_DATES in fields:
+        date_keys += ['created_at', 'updated_at']
+    for key in date_keys:
+        if key in source:
+            projected[key] = _maybe_str2dt(source[key])
+
+    if FIELD_NOTES in fields and 'notes' in source:
+        projected['notes'] = source['notes']
+    if FIELD_PROPERTIES in fields and 'properties' in source:
+        projected['properties'] = source['properties']
+
+    # the state depends on the last logbook entry
+    n = fields.get(FIELD_LOGBOOK, 1 if FIELD_STATE in fields else 0)
+    logbook = source.get('logbook', [])
+    if n is None:
+        projected['logbook'] = [_convert_log(log) for log in logbook]
+    elif n > 0:
+        projected['logbook'] = [_convert_log(log) for log in logbook[-n:]]
+
+    if FIELD_TOTALS in fields and n is not None:
+        if 'closed_time_spent' in source:
+            projected['time_spent'] = (source['closed_time_spent'] +
+                                       time_spent_on(source['open_logbook']))
+        else:
+            projected['time_spent'] = time_spent_on([_convert_log(log)
+                                                     for log in logbook])
+
+    return projected
+
 # ===========================================
 # Filtering
 
@@ -105,6 +259,20 @@ def _cast_values(d, t=int):
     return {k: t(v) if v else 0 for k, v in d.items()}
 
 
+# 2018-03-24-15:40
+DATE_PATTERN = re.compile(r'^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})(-(?P<hour>\d{2}):(?P<minute>\d{2}))?$')
+
+# 15:40
+TIME_PATTERN = re.compile(r'^(?P<hours>\d{2}):(?P<minutes>\d{2})$')
+
+# 2d13h25min
+REL_DATE_PATTERN = re.compile(r'^((?P<days>[+-]?\d+)d)?((?P<hours>[+-]?\d+)h)?((?P<minutes>[+-]?\d+)min)?$')
+
+
+def is_relative_to_now(string):
+    return string in ["now"] or bool(string and REL_DATE_PATTERN.search(string))
+
+
 def interpret_date(string):
 
     if string in ["now"]:
@@ -114,24 +282,15 @@ def interpret_date(string):
     elif string in ["yesterday", "yd"]:
         return today() - timedelta(days=-1)
 
-    # 2018-03-24-15:40
-    date_p = r'^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})(-(?P<hour>\d{2}):(?P<minute>\d{2}))?$'
-
-    date_m = re.search(date_p, string)
+    date_m = DATE_PATTERN.search(string)
     if date_m:
-        return datetime(**_cast_values(date_m.groupdict()), tzinfo=LOCALZONE)
-
-    # 15:40
-    time_p = r'^(?P<hours>\d{2}):(?P<minutes>\d{2})$'
+        return datetime(**_cast_values(date_m.groupdict()), tzinfo=local_zone())
 
-    time_m = re.search(time_p, string)
+    time_m = TIME_PATTERN.search(string)
     if time_m:
         return today() + timedelta(**_cast_values(time_m.groupdict()))
 
-    # 2d13h25min
-    rel_p = r'^((?P<days>[+-]?\d+)d)?((?P<hours>[+-]?\d+)h)?((?P<minutes>[+-]?\d+)min)?$'
-
-    rel_m = re.search(rel_p, string)
+    rel_m = REL_DATE_PATTERN.search(string)
     if string and rel_m:
         return now() + timedelta(**_cast_values(rel_m.groupdict()))
 
@@ -184,14 +343,15 @@ def apply_filter_from(data, date):
 
 
 def apply_filters(data, filters):
+    with span("filters", "filter"):
 
-    if data and 'where' in filters:
-        data = apply_filter_where(data, filters['where'])
+        if data and 'where' in filters:
+            data = apply_filter_where(data, filters['where'])
 
-    if data and 'from' in filters:
-        data = apply_filter_from(data, filters['from'])
+        if data and 'from' in filters:
+            data = apply_filter_from(data, filters['from'])
 
-    if data and 'to' in filters:
-        data = apply_filter_to(data, filters['to'])
+        if data and 'to' in filters:
+            data = apply_filter_to(data, filters['to'])
 
-    return data
+        return data
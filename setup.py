@@ -1,6 +1,30 @@
 # -*- coding: utf-8 -*-
 
 from setuptools import setup
+from setuptools.command.build_py import build_py
+from setuptools.command.sdist import sdist
+
+
+def save_command_info():
+    # dit/command_info.tsv, read by dit-completion, is generated from the
+    # commands of dit instead of being kept in git
+    from dit.completion import _save_command_info
+    _save_command_info()
+
+
+class BuildPy(build_py):
+
+    def run(self):
+        save_command_info()
+        super().run()
+
+
+class SDist(sdist):
+
+    def run(self):
+        save_command_info()
+        super().run()
+
 
 setup(
     name='dit',
@@ -38,11 +62,18 @@ setup(
     },
 
     package_data={
-        'dit': ['command_info.json'],
+        'dit': ['command_info.tsv'],
+    },
+
+    cmdclass={
+        'build_py': BuildPy,
+        'sdist': SDist,
     },
 
     entry_points={
         'console_scripts': ['dit=dit:main',
                             'dit-completion=dit:completion'],
+        'dit.exporters': ['dit=dit.dit_exporter',
+                          'org=dit.org_exporter'],
     },
 )
@@ -0,0 +1,17 @@
+#!/usr/bin/env bash
+
+./ditcmd list --all --id-only --limit 3
+./ditcmd list --limit 2 g5
+
+./ditcmd list --all --sort recent --limit 3
+./ditcmd list --all --concluded --sort time-spent --limit 2
+./ditcmd list --all --concluded --sort created --limit 2 --id-only
+./ditcmd list --sort title g5
+./ditcmd list --all --concluded --sort time-spent --from '19:30' --limit 1
+
+./ditcmd export --all --format org --sort title --limit 2
+
+./ditcmd list --all --sort wrong
+./ditcmd list --all --limit 0
+./ditcmd export --all --limit x
+./ditcmd status --limit
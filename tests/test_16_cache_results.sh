@@ -0,0 +1,14 @@
+#!/usr/bin/env bash
+
+./ditcmd --cache-results status
+./ditcmd --cache-results status     # replayed
+./ditcmd --cache-results list --sum g5
+./ditcmd --cache-results list --sum g5     # replayed
+
+./ditcmd workon g5/g6/t8
+./ditcmd --cache-results status     # workon changed the dit directory
+./ditcmd --cache-results status     # replayed
+./ditcmd --cache-results list --from -1h g5     # relative to now, not cached
+./ditcmd halt
+
+./ditcmd --cache-results status
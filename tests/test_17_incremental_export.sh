@@ -0,0 +1,14 @@
+#!/usr/bin/env bash
+
+./ditcmd export --all --concluded --format org --incremental --state-file org.state
+./ditcmd export --all --concluded --format org --incremental --state-file org.state
+
+./ditcmd note --task g5/g6/t8 'Only group g5 is exported again.'
+./ditcmd export --all --concluded --format org --incremental --state-file org.state
+
+./ditcmd export --concluded --incremental --state-file dit.state g5
+./ditcmd export --concluded --incremental --state-file dit.state g5/g6
+./ditcmd export --concluded --incremental --state-file dit.state g5/g6
+
+./ditcmd export --all --incremental
+./ditcmd export --all --incremental --sum --state-file dit.state
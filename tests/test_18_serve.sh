@@ -0,0 +1,24 @@
+#!/usr/bin/env bash
+
+# commands are only forwarded when neither stdin nor stdout is a terminal
+dit -d ./ditdir serve < /dev/null &> /dev/null &
+server=$!
+trap "kill $server 2> /dev/null" EXIT
+
+socket=$(python3 -c "from dit.client import server_path; print(server_path('./ditdir'))")
+for i in $(seq 50); do
+    [ -S "$socket" ] && break
+    sleep 0.1
+done
+
+./ditcmd status < /dev/null
+./ditcmd workon g5/g6/t8 < /dev/null
+./ditcmd list --sum g5 < /dev/null
+./ditcmd halt < /dev/null
+./ditcmd status < /dev/null
+./ditcmd nothing < /dev/null
+
+./ditcmd serve < /dev/null
+./ditcmd serve --stop < /dev/null
+wait $server
+./ditcmd serve --stop < /dev/null
@@ -0,0 +1,27 @@
+#!/usr/bin/env bash
+
+source ../bash-completion/dit
+
+step(){
+    echo '---------------------------------------------------'
+    echo "$ $2<TAB><TAB>"
+
+    COMP_LINE="$2"
+    COMP_WORDS=( $COMP_LINE )
+    COMP_CWORD=$1
+    _dit
+    echo ${COMPREPLY[*]} | tr ' ' '\n' | sort | tr '\n' ' '
+    echo ''
+}
+
+step 4 "dit -d ditdir w g5/"
+step 4 "dit -d ditdir w g5/g6/"
+step 4 "dit -d ditdir w g5/g6/t1"
+
+./ditcmd new g5/g6/t12 'Saving the index updates the completion cache.'
+step 4 "dit -d ditdir w g5/g6/t1"
+
+# the index is modified outside of dit
+mv ditdir/g4 ditdir/g8
+sed -i 's/"g4"/"g8"/' ditdir/.index
+step 4 "dit -d ditdir w g"
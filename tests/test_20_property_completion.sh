@@ -0,0 +1,41 @@
+#!/usr/bin/env bash
+
+source ../bash-completion/dit
+
+step(){
+    echo '---------------------------------------------------'
+    echo "$ $2<TAB><TAB>"
+
+    COMP_LINE="$2"
+    COMP_WORDS=( $COMP_LINE )
+    COMP_CWORD=$1
+    _dit
+    # one per line, since values may have spaces
+    printf '%s\n' "${COMPREPLY[@]}" | sort
+}
+
+step 4 "dit -d ditdir set"
+step 4 "dit -d ditdir set p"
+step 5 "dit -d ditdir set pName"
+step 6 "dit -d ditdir set -t g5/g6/t12"
+step 6 "dit -d ditdir set -t g5/g6/t12 p"
+
+./ditcmd set -t g5/g6/t12 priority high
+./ditcmd set -t g5/g6/t8 priority "very low"
+step 5 "dit -d ditdir set priority"
+step 7 "dit -d ditdir set -t g5/g6/t12 priority v"
+
+step 6 "dit -d ditdir l -a -w"
+step 7 "dit -d ditdir l -a --where priority"
+step 7 "dit -d ditdir l -a --where priority h"
+
+# ids
+step 4 "dit -d ditdir l 1"
+step 4 "dit -d ditdir l 1/"
+step 4 "dit -d ditdir w 1/0/"
+
+# task files modified outside of dit are only seen after rebuild-index
+sed -i 's/"high"/"urgent"/' ditdir/g5/g6/t12
+step 5 "dit -d ditdir set priority"
+./ditcmd rebuild-index
+step 5 "dit -d ditdir set priority"
@@ -0,0 +1,30 @@
+#!/usr/bin/env bash
+
+cat > batch.in <<'END'
+# many commands, written once at the end
+halt
+new b1/s/t1 "Batch task 1"
+new b1/s/t2 'Batch task 2'
+workon --at -30min b1/s/t1
+note "Noted in a batch"
+set priority low
+switchto b1/s/t2
+list b1
+nosuchcommand
+halt
+move b1/s/t1 b1/s/t3
+note -t "b1/s/t3
+END
+
+./ditcmd batch batch.in
+./ditcmd list -v b1
+./ditcmd status
+
+# from stdin, stopping at the first error
+printf 'workon b1/s/t3\nnote -t b1/s/t9 Lost\nhalt\n' | ./ditcmd batch --stop-on-error -
+./ditcmd status
+
+# each listing starts afresh, neither verbose nor adding to the last sum
+printf 'list --verbose b1/s/t2\nlist b1/s/t2\nlist --sum b1/s/t2\nlist --sum b1/s/t2\n' | ./ditcmd batch -
+
+rm batch.in
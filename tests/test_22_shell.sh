@@ -0,0 +1,16 @@
+#!/usr/bin/env bash
+
+# the state modified outside of the shell is loaded again, and each listing
+# starts afresh
+{
+    echo 'list --sum b1/s/t2'
+    echo 'list --sum b1/s/t2'
+    echo 'workon b1/s/t2'
+    echo 'status'
+    echo 'batch'
+    sleep 1
+    ./ditcmd halt > /dev/null 2>&1
+    echo 'status'
+    echo 'exit'
+    echo 'status'
+} | ./ditcmd shell
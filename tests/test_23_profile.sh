@@ -0,0 +1,11 @@
+#!/usr/bin/env bash
+
+# the timings vary, the phases and their calls do not (without the task
+# cache, whose hits depend on how recently the task files were written)
+echo '$ dit --no-cache --profile export --format org'
+dit -d ./ditdir --no-cache --profile export --format org 2>&1 > /dev/null | sed -E 's/ +[0-9.]+ms +[0-9.]+ms$//; s/ +/ /g' | grep -v '^phase\|^total' | sort
+
+echo '$ dit --profile-json profile.json list'
+dit -d ./ditdir --profile-json profile.json list > /dev/null
+grep -o '"phases": {"hook before": {"calls": 1' profile.json
+rm profile.json
@@ -0,0 +1,7 @@
+#!/usr/bin/env bash
+
+# the times and pids vary, the spans do not (without the task cache, whose
+# hits depend on how recently the task files were written)
+DIT_TRACE=trace.json ./ditcmd --no-cache list --where pName pValue
+grep -o '"name": "[^"]*", "cat": "[^"]*"' trace.json | sort | uniq -c
+rm trace.json
@@ -0,0 +1,29 @@
+#!/usr/bin/env bash
+
+mkdir -p ditdir/.hooks
+cat > ditdir/.hooks/hooks.py <<'EOF'
+def _show(event):
+    print("%s %s: %s" % (event.hook, event.command, event.tasks))
+    for selector in event.tasks:
+        before = event.before[selector] or {}
+        after = event.after[selector] or {}
+        print("  %s: %s -> %s" % (selector, before.get('title'),
+                                  after.get('title')))
+
+
+before = _show
+after_write = _show
+
+
+def after_read(event):
+    raise RuntimeError("cannot read")
+EOF
+
+./ditcmd new h1/s/t1 "Hooked task"
+./ditcmd move h1/s/t1 h1/s/t2
+./ditcmd list h1/s/t2
+./ditcmd --check-hooks list h1/s/t2
+
+printf 'workon h1/s/t2\nnote -t h1/s/t9 Lost\nhalt\n' | ./ditcmd batch --command-hooks -
+
+rm -r ditdir/.hooks
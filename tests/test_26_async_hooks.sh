@@ -0,0 +1,20 @@
+#!/usr/bin/env bash
+
+mkdir -p ditdir/.hooks/spool
+cat > ditdir/.hooks/after_write.async <<'EOF'
+#!/usr/bin/env bash
+echo "after_write.async: $@"
+EOF
+chmod +x ditdir/.hooks/after_write.async
+
+# while the lock is held, the worker cannot start and the events stay queued
+flock -o ditdir/.hooks/spool/worker.lock bash -c \
+      './ditcmd workon h1/s/t2; ./ditcmd halt; sleep 1; ./ditcmd hooks status'
+./ditcmd hooks drain | sed 's/^\[[^]]*\] //'
+./ditcmd hooks
+
+# run synchronously
+./ditcmd --check-hooks note -t h1/s/t2 "Synchronous"
+./ditcmd hooks status
+
+rm -r ditdir/.hooks
@@ -0,0 +1,40 @@
+#!/usr/bin/env bash
+
+mkdir -p ditdir/.hooks
+cat > ditdir/.hooks/after_write <<'EOF'
+#!/usr/bin/env python3
+import json
+import os
+
+with open(os.environ['DIT_HOOK_EVENT']) as f:
+    event = json.load(f)
+print("%s %s: %s" % (event['hook'], event['command'], event['tasks']))
+for selector in event['tasks']:
+    before = event['before'][selector] or {}
+    after = event['after'][selector] or {}
+    print("  %s: %d -> %d logbook entries, %d -> %d notes"
+          % (selector, len(before.get('logbook', [])),
+             len(after.get('logbook', [])), len(before.get('notes', [])),
+             len(after.get('notes', []))))
+for name in ['current', 'previous']:
+    print("  %s: %s -> %s" % (name, json.dumps(event[name]['before'],
+                                               sort_keys=True),
+                              json.dumps(event[name]['after'],
+                                         sort_keys=True)))
+EOF
+cat > ditdir/.hooks/before <<'EOF'
+#!/usr/bin/env bash
+cat "$DIT_HOOK_EVENT"
+echo
+# stdin is still that of dit
+if read -r -t 1 line; then
+    echo "Read: $line"
+fi
+EOF
+chmod +x ditdir/.hooks/after_write ditdir/.hooks/before
+
+./ditcmd workon h1/s/t2 < /dev/null
+./ditcmd note "With a payload" < /dev/null
+echo "Typed in" | ./ditcmd switchto b1/s/t3
+
+rm -r ditdir/.hooks
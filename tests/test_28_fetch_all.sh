@@ -0,0 +1,14 @@
+#!/usr/bin/env bash
+
+# the fetchers of test 10 are still there
+./ditcmd fetch --group g5 --jobs 2
+./ditcmd list --verbose g5
+
+# the tasks of g1 are left alone, those that fail are reported
+rm ./ditdir/g1/.fetcher
+./ditcmd fetch --all
+./ditcmd list --verbose g5/g6/t11
+
+./ditcmd fetch --group g5/g6/t11
+./ditcmd fetch --group g2
+./ditcmd fetch --all --jobs 0
@@ -0,0 +1,18 @@
+#!/usr/bin/env bash
+
+# nearer than the ".fetcher" of g5
+cp test_29_stream_fetcher.script ./ditdir/g5/g6/.fetcher.stream
+chmod +x ./ditdir/g5/g6/.fetcher.stream
+
+# a single one for all the commands of a batch
+printf 'fetch g5/g6/t11\nfetch g5/g6/t12\nnew --fetch g5/g6/t20\n' | ./ditcmd batch -
+./ditcmd list --verbose g5/g6
+
+./ditcmd fetch --group g5 --jobs 2
+
+# g5/./t9 still uses ".fetcher"
+./ditcmd list g5
+
+# one that hangs is killed
+DIT_FETCH_TIMEOUT=0.5 ./ditcmd new --fetch g5/g6/t21
+./ditcmd list g5/g6/t21
@@ -0,0 +1,27 @@
+#!/usr/bin/env bash
+
+export XDG_CACHE_HOME=./fetch-cache
+
+mkdir -p ./ditdir/g9
+cat > ./ditdir/g9/.fetcher <<'END'
+#!/usr/bin/env bash
+echo "Fetcher arguments: $@ (validator: ${DIT_FETCH_VALIDATOR:-none})"
+if [ "$DIT_FETCH_VALIDATOR" = "v1" ]; then
+    exit 0  # not modified
+fi
+cat > $1/$2/$3/$4.json <<EOF
+{"title": "Fetched $2 $3 $4.", "validator": "v1"}
+EOF
+END
+chmod +x ./ditdir/g9/.fetcher
+
+./ditcmd new --fetch g9/s/t1
+
+# given the validator, the fetcher tells it was not modified
+./ditcmd fetch g9/s/t1
+./ditcmd list --verbose g9/s/t1
+
+# not even called
+DIT_FETCH_TTL=60 ./ditcmd fetch g9/s/t1
+
+rm -rf ./fetch-cache
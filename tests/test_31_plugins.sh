@@ -0,0 +1,35 @@
+#!/usr/bin/env bash
+
+# load timings vary
+./ditcmd plugins | sed 's/ *[0-9.]*ms$//'
+
+# an exporter installed as a "dit_Xexporter" module
+cat > dit_titles_exporter.py <<'END'
+def setup(file, options):
+    global _file
+    _file = file
+
+def fields():
+    return ["title"]
+
+def begin():
+    pass
+
+def end():
+    pass
+
+def group(group, group_id):
+    pass
+
+def subgroup(group, group_id, subgroup, subgroup_id):
+    pass
+
+def task(group, group_id, subgroup, subgroup_id, task, task_id, data):
+    _file.write("%s: %s\n" % (task, data.get("title")))
+END
+
+PYTHONPATH=. ./ditcmd plugins | sed 's/ *[0-9.]*ms$//'
+PYTHONPATH=. ./ditcmd export --format titles g9
+
+rm -rf dit_titles_exporter.py __pycache__
+./ditcmd export --format titles g9
@@ -0,0 +1,32 @@
+#!/usr/bin/env bash
+
+# a task locked by another process is waited for, up to DIT_LOCK_TIMEOUT
+flock ./ditdir/g9/s/.t1.lock \
+    bash -c 'DIT_LOCK_TIMEOUT=0.2 ./ditcmd note -t g9/s/t1 "Not noted"'
+./ditcmd list --verbose g9/s/t1
+
+# none of the notes is lost (away from DIT_TESTING, which is not shared)
+(
+    cd ./ditdir
+    for i in 1 2 3 4 5 6 7 8; do
+        dit --no-hooks -d . note -t g9/s/t1 "Noted concurrently" > /dev/null &
+    done
+    wait
+)
+./ditcmd list --verbose g9/s/t1 | grep -c "Noted concurrently"
+
+# nor any of the tasks in the index
+(
+    cd ./ditdir
+    for i in $(seq 1 12); do
+        dit --no-hooks -d . new g10/s/t$i "Created concurrently" > /dev/null &
+    done
+    wait
+)
+python3 -c 'import json, sys
+index = dict(json.load(sys.stdin))
+print(sorted(dict(index["g10"])["s"], key=lambda task: int(task[1:])))' \
+    < ./ditdir/.index
+
+# nor any lock or temporary file left
+find ./ditdir -name '*.lock' -o -name '*.tmp'